@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+AST_EXPLORER = Path(__file__).resolve().parent / "ast_explorer.py"
+
+MODES: dict[str, list[str]] = {
+    "header_only": ["--header_only"],
+    "summary_only": ["--summary_only"],
+    "full": [],
+    "show_imports": ["--show_imports"],
+    "sorted": ["--sorted"],
+}
+
+TYPE_NAMES = ["int", "str", "float", "bytes", "list[int]", "dict[str, int]", "None"]
+
+
+def generate_module(
+    rng: random.Random,
+    module_index: int,
+    module_names: list[str],
+    classes: int,
+    methods: int,
+    functions: int,
+    nesting: int,
+    import_density: float,
+) -> str:
+    lines = ['"""Synthetic module generated by ast_benchmark.py."""', "import os", ""]
+    for target in module_names:
+        if rng.random() < import_density:
+            lines.append(f"from {target} import helper_0")
+    lines.append("")
+
+    def body(indent: str, depth: int) -> list[str]:
+        if depth == 0:
+            return [f"{indent}return value"]
+        return [
+            f"{indent}for item in range(value):",
+            f"{indent}    if item % 2 and value > {depth}:",
+            *body(indent + "        ", depth - 1),
+            f"{indent}return value",
+        ]
+
+    def function(indent: str, name: str, is_method: bool) -> list[str]:
+        annotation = rng.choice(TYPE_NAMES)
+        args = "self, value: int" if is_method else "value: int, other=None"
+        return [
+            f"{indent}def {name}({args}) -> {annotation}:",
+            f'{indent}    """Docstring mentioning def fake() and class Fake."""',
+            *body(indent + "    ", nesting),
+            "",
+        ]
+
+    for class_index in range(classes):
+        base = f"(Base{class_index - 1})" if class_index else ""
+        lines.append(f"class Base{class_index}{base}:")
+        for method_index in range(methods):
+            lines += function("    ", f"method_{module_index}_{method_index}", True)
+        lines.append("")
+    for function_index in range(functions):
+        lines += function("", f"helper_{function_index}", False)
+    return "\n".join(lines) + "\n"
+
+
+def generate_tree(
+    root: Path,
+    files: int,
+    classes: int,
+    methods: int,
+    functions: int,
+    nesting: int,
+    import_density: float,
+    files_per_package: int,
+    seed: int,
+) -> None:
+    rng = random.Random(seed)
+    module_paths = []
+    for index in range(files):
+        package = f"pkg_{index // files_per_package}"
+        module_paths.append((package, f"mod_{index}"))
+
+    for package in {package for package, _ in module_paths}:
+        (root / package).mkdir(parents=True, exist_ok=True)
+        (root / package / "__init__.py").write_text("")
+
+    module_names = [f"{package}.{module}" for package, module in module_paths]
+    for index, (package, module) in enumerate(module_paths):
+        # Import a small random sample so import density doesn't grow with size.
+        candidates = rng.sample(module_names, min(len(module_names), 20))
+        source = generate_module(
+            rng,
+            index,
+            candidates,
+            classes,
+            methods,
+            functions,
+            nesting,
+            import_density,
+        )
+        (root / package / f"{module}.py").write_text(source)
+
+
+def count_tree(root: Path) -> tuple[int, int]:
+    files = 0
+    lines = 0
+    for path in root.rglob("*.py"):
+        files += 1
+        with path.open("rb") as f:
+            lines += sum(1 for _ in f)
+    return files, lines
+
+
+def max_rss_bytes(rusage) -> int:
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS.
+    if sys.platform == "darwin":
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss * 1024
+
+
+def run_mode(
+    tree: Path, flags: list[str], extra_args: list[str]
+) -> tuple[float, int, str]:
+    command = [
+        sys.executable,
+        str(AST_EXPLORER),
+        str(tree),
+        "-r",
+        "--no_cache",
+        *flags,
+        *extra_args,
+    ]
+    with tempfile.TemporaryFile() as stdout:
+        t0 = time.perf_counter()
+        process = subprocess.Popen(command, stdout=stdout, stderr=subprocess.DEVNULL)
+        # wait4 gives the rusage of this child alone, unlike RUSAGE_CHILDREN.
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - t0
+        returncode = os.waitstatus_to_exitcode(status)
+        if returncode != 0:
+            raise RuntimeError(f"{' '.join(command)} exited with {returncode}")
+        stdout.seek(0)
+        totals = [
+            line
+            for line in stdout.read().decode(errors="replace").splitlines()
+            if line.startswith("Total:")
+        ]
+    return elapsed, max_rss_bytes(rusage), totals[-1] if totals else ""
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for mode, result in results["modes"].items():
+        previous = baseline.get("modes", {}).get(mode)
+        if previous is None:
+            continue
+        for metric in ("seconds", "max_rss_bytes"):
+            if result[metric] > previous[metric] * (1 + threshold):
+                regressions.append(
+                    f"{mode}: {metric} {previous[metric]:.4g} -> {result[metric]:.4g}"
+                    f" (+{(result[metric] / previous[metric] - 1) * 100:.1f}%)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark ast_explorer.py on a synthetic codebase."
+    )
+    parser.add_argument("--files", type=int, default=1000, help="Number of modules.")
+    parser.add_argument("--classes", type=int, default=3, help="Classes per module.")
+    parser.add_argument("--methods", type=int, default=5, help="Methods per class.")
+    parser.add_argument(
+        "--functions", type=int, default=5, help="Module-level functions per module."
+    )
+    parser.add_argument(
+        "--nesting", type=int, default=2, help="Block nesting depth of function bodies."
+    )
+    parser.add_argument(
+        "--import_density",
+        type=float,
+        default=0.25,
+        help="Probability of importing each of 20 sampled sibling modules.",
+    )
+    parser.add_argument(
+        "--files_per_package", type=int, default=50, help="Modules per package."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Generator seed.")
+    parser.add_argument(
+        "--modes",
+        nargs="*",
+        choices=list(MODES),
+        default=list(MODES),
+        help="Modes to time (default: all).",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per mode; the median is reported."
+    )
+    parser.add_argument(
+        "--tree",
+        type=Path,
+        help="Reuse/generate the synthetic tree here instead of a temporary directory.",
+    )
+    parser.add_argument("--output", type=Path, help="Write the results as JSON.")
+    parser.add_argument(
+        "--baseline", type=Path, help="Compare against a previous --output file."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="Relative slowdown/growth against --baseline that counts as a regression.",
+    )
+    parser.add_argument(
+        "extra_args",
+        nargs=argparse.REMAINDER,
+        help="Arguments after -- are passed to ast_explorer.py (e.g. -- -j 1).",
+    )
+    args = parser.parse_args()
+    extra_args = [arg for arg in args.extra_args if arg != "--"]
+
+    generator_config = {
+        "files": args.files,
+        "classes": args.classes,
+        "methods": args.methods,
+        "functions": args.functions,
+        "nesting": args.nesting,
+        "import_density": args.import_density,
+        "files_per_package": args.files_per_package,
+        "seed": args.seed,
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tree = args.tree or Path(tmp_dir) / "tree"
+        if not tree.exists() or not any(tree.iterdir()):
+            print(f"Generating {args.files} modules in {tree}", file=sys.stderr)
+            generate_tree(tree, **generator_config)
+        files, lines = count_tree(tree)
+
+        results = {
+            "config": generator_config,
+            "extra_args": extra_args,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "files": files,
+            "lines": lines,
+            "modes": {},
+        }
+        totals = {}
+        for mode in args.modes:
+            timings = []
+            rss = []
+            for _ in range(args.repeat):
+                elapsed, max_rss, total = run_mode(tree, MODES[mode], extra_args)
+                timings.append(elapsed)
+                rss.append(max_rss)
+            seconds = statistics.median(timings)
+            results["modes"][mode] = {
+                "seconds": seconds,
+                "files_per_second": files / seconds,
+                "lines_per_second": lines / seconds,
+                "max_rss_bytes": max(rss),
+                "runs": timings,
+            }
+            totals[mode] = total
+            print(
+                f"{mode:14} {seconds:8.3f}s {files / seconds:10.0f} files/s"
+                f" {lines / seconds:12.0f} lines/s {max(rss) / 2**20:8.1f} MiB"
+            )
+
+    # Every mode scans the same tree, so they have to agree on the totals.
+    if len(set(totals.values())) > 1:
+        print("\nModes disagree on the totals:", file=sys.stderr)
+        for mode, total in totals.items():
+            print(f"\t{mode}: {total.strip()}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=4) + "\n")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("config") != generator_config:
+            print(
+                "Warning: baseline was recorded with a different tree.", file=sys.stderr
+            )
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"\t{regression}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,33 @@
 import argparse
 import ast  # Abstract Syntax Tree
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import marshal
 import os
+import re
+import selectors
+import signal
+import socket
+import sqlite3
+import struct
+import subprocess
 import sys
-from dataclasses import dataclass
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext, redirect_stderr, redirect_stdout
+from dataclasses import dataclass, field, replace
+from functools import partial
+from typing import NamedTuple, Optional
 
 from termcolor import colored
 
@@ -13,6 +38,7 @@ class Colors:
     classname: str = "yellow"
     functionname: str = "red"
     argname: str = "blue"
+    metrics: str = "cyan"
 
 
 @dataclass
@@ -22,228 +48,3187 @@ class Messages:
     )
     class_header: str = "\t{lineno:4} {class_name}"
     function_detail: str = (
-        "\t\t{lineno:4} {function_name}({args_with_hints}) -> {return_type}{link}"
+        "\t\t{lineno:4} {function_name}({args_with_hints}) -> {return_type}{metrics}{link}"
     )
     standalone_function: str = (
-        "{lineno:04} {function_name}({args_with_hints}) -> {return_type}{link}"
+        "{lineno:04} {function_name}({args_with_hints}) -> {return_type}{metrics}{link}"
     )
     error_processing: str = "Error processing {file_path}: {error}"
     summary: str = "\nTotal: Files={total_files}, Lines={total_lines}, Functions={total_functions}, Classes={total_classes}"
+    error_listing: str = "Error listing {directory}: {error}"
+    cache_stats: str = "Cache: hits={hits}, misses={misses}, entries={entries}"
+    error_cache: str = "Ignoring unreadable cache {cache_path}: {error}"
+    error_cache_moved: str = (
+        "Moved unreadable cache {cache_path} to {backup_path}: {error}"
+    )
+    index_stats: str = (
+        "Indexed {files} files ({updated} updated, {removed} removed) in {db}"
+    )
+    query_result: str = "{kind:8} {symbol}{link}"
+    graph_header: str = "Modules={modules}, Imports={imports}, Cycles={cycles}"
+    graph_cycle: str = "\t{size:4} {members}"
+    graph_rank: str = "\t{count:4} {module}"
+    graph_closure: str = "\t{depth:4} {module}{chain}"
+    unknown_module: str = "Error: Module {module} was not found in the scanned files."
+    watch_ready: str = "Watching {files} files ({watcher}), listening on {socket_path}"
+    watch_fallback: str = "inotify unavailable ({error}), polling every {interval}s"
+    profile_header: str = "\n{phase:10} {calls:>8} {seconds:>10} {mean:>10} {share:>7}"
+    profile_row: str = "{phase:10} {calls:8} {seconds:10.4f} {mean:10.4f} {share:6.1f}%"
+    profile_file: str = "\t{seconds:8.4f} {file_path}"
+    ranking_header: str = "\nTop {count} functions by {metric}:"
+    ranking_row: str = "\t{value:6} {function_name} {metrics}{link}"
+    duplicates_header: str = (
+        "\nDuplicate functions: {clusters} clusters, {functions} functions ({mode})"
+    )
+    duplicate_cluster: str = "\t{count} copies, {statements} statements, {fingerprint}"
+    duplicate_member: str = "\t\t{function_name}{link}"
+    revision_header: str = "\n{rev} {subject}"
+    signature_added: str = "+ {path}:{lineno} {signature}"
+    signature_removed: str = "- {path}:{lineno} {signature}"
+    signature_changed: str = "~ {path}:{lineno} {old}\n  {path}:{lineno} {new}"
+    diff_summary: str = (
+        "\nSignatures: added={added}, removed={removed}, changed={changed} (blobs parsed={parsed}, reused={reused})"
+    )
+    error_git: str = "Error: {error}"
+
+
+DEFAULT_SKIP_DIRS = (".*", "__pycache__", "node_modules", "venv", "build", "dist")
+ARCHIVE_SUFFIXES = (".whl", ".zip", ".egg")
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+# Below this many files the process pool costs more than it saves.
+MIN_PARALLEL_FILES = 16
+# --stream sends files to the pool in chunks of this size.
+STREAM_CHUNK_SIZE = 32
+DEFAULT_MAX_IN_FLIGHT = 1024
+# The daemon serves one client at a time, so a stalled one is dropped after this.
+WATCH_REQUEST_TIMEOUT = 5.0
+
+# Bump whenever FileSummary or the extraction output changes shape.
+CACHE_FORMAT = 8
+CACHE_VERSION = (CACHE_FORMAT, sys.implementation.name, sys.version_info[:3])
+DEFAULT_CACHE_MAX_ENTRIES = 100_000
+# New cache entries are written in batches of this size.
+CACHE_FLUSH_ENTRIES = 1024
+
+
+@dataclass
+class FileSummary:
+    file_path: str
+    lines: int = 0
+    class_details: list = field(default_factory=list)
+    function_details: list = field(default_factory=list)
+    import_details: list = field(default_factory=list)
+    error: Optional[str] = None
+    digest: Optional[str] = None
+    # Set instead of the detail lists by the count-only tier.
+    function_count: Optional[int] = None
+    class_count: Optional[int] = None
+    # phase -> [seconds, calls], only filled in with --profile.
+    timings: Optional[dict] = None
+    # Names of the analysis passes whose metrics the function records carry.
+    passes: tuple = ()
+
+    def satisfies(self, counts_only=False, passes=()):
+        if self.counts_only and not counts_only:
+            return False
+        return all(name in self.passes for name in passes)
+
+    @property
+    def counts_only(self):
+        return self.function_count is not None
+
+    # Copy whose function records carry only the metrics of `passes`.
+    def with_metrics(self, passes):
+        passes = tuple(passes)
+        if self.passes == passes:
+            return self
+        return replace(
+            self,
+            class_details=[
+                cls._replace(
+                    functions=[restrict_metrics(func, passes) for func in cls.functions]
+                )
+                for cls in self.class_details
+            ],
+            function_details=[
+                restrict_metrics(func, passes) for func in self.function_details
+            ],
+            passes=passes,
+        )
+
+    @property
+    def functions(self):
+        if self.function_count is not None:
+            return self.function_count
+        return len(self.function_details) + sum(
+            len(cls.functions) for cls in self.class_details
+        )
+
+    @property
+    def classes(self):
+        if self.class_count is not None:
+            return self.class_count
+        return len(self.class_details)
+
+
+class ImportRecord(NamedTuple):
+    lineno: int
+    statement: str
+    module: Optional[str]  # `from <module> import ...`, None for plain `import`
+    names: tuple
+    level: int
+
+
+class FunctionRecord(NamedTuple):
+    name: str
+    lineno: int
+    args: tuple  # ((arg_name, annotation or None), ...)
+    return_type: Optional[str]
+    metrics: Optional[dict] = None  # pass name -> value, with --analyze
+
+
+def restrict_metrics(func, passes):
+    if func.metrics is None:
+        return func
+    metrics = {name: func.metrics[name] for name in passes if name in func.metrics}
+    return func._replace(metrics=metrics or None)
+
+
+class ClassRecord(NamedTuple):
+    name: str
+    lineno: int
+    bases: tuple
+    functions: list
+
+
+# Only statements can define classes, functions or imports, so the walk never
+# has to descend into expressions.
+BLOCK_FIELDS = frozenset(("body", "orelse", "finalbody", "handlers", "cases"))
+_block_fields_by_type = {}
+
+
+def block_fields(node_type):
+    fields = _block_fields_by_type.get(node_type)
+    if fields is None:
+        fields = tuple(name for name in node_type._fields if name in BLOCK_FIELDS)
+        _block_fields_by_type[node_type] = fields
+    return fields
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, phase, seconds, calls=1):
+        entry = self.phases.get(phase)
+        if entry is None:
+            self.phases[phase] = [seconds, calls]
+        else:
+            entry[0] += seconds
+            entry[1] += calls
+
+    def seconds(self, phase):
+        return self.phases.get(phase, (0.0, 0))[0]
+
+    def merge(self, phases):
+        for phase, (seconds, calls) in phases.items():
+            self.add(phase, seconds, calls)
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def wrap(self, name, func):
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - t0)
+
+        return timed
+
+
+# Per-function analysis passes. A pass maps node types to handlers of the form
+# handler(value, node, depth) -> value, where depth is the block nesting depth
+# inside the enclosing function. extract_from_source merges the handlers of
+# every requested pass into one dispatch table and runs them during its
+# single walk, so adding a pass never adds a traversal.
+class AnalysisPass:
+    name = None
+    # Part of a bare --analyze and usable with --top.
+    default = True
+    # Also counts the bodies of nested functions, which still get their own
+    # records (and frames) as well.
+    inclusive = False
+
+    def start(self, node, owner):
+        return 0
+
+    def handlers(self):
+        return {}
+
+    # Applied to the value once the whole file has been walked.
+    def finish(self, value):
+        return value
+
+
+ANALYSIS_PASSES = {}
+
+
+def register_pass(cls):
+    ANALYSIS_PASSES[cls.name] = cls()
+    return cls
+
+
+def increment(value, node, depth):
+    return value + 1
+
+
+@register_pass
+class ComplexityPass(AnalysisPass):
+    name = "complexity"
+    branch_types = (
+        ast.If,
+        ast.IfExp,
+        ast.For,
+        ast.AsyncFor,
+        ast.While,
+        ast.ExceptHandler,
+        ast.match_case,
+    )
+
+    def start(self, node, owner):
+        return 1
+
+    def handlers(self):
+        return {
+            **dict.fromkeys(self.branch_types, increment),
+            ast.BoolOp: lambda value, node, depth: value + len(node.values) - 1,
+            ast.comprehension: lambda value, node, depth: value + 1 + len(node.ifs),
+        }
+
+
+@register_pass
+class NestingPass(AnalysisPass):
+    name = "nesting"
+    block_types = (
+        ast.If,
+        ast.For,
+        ast.AsyncFor,
+        ast.While,
+        ast.With,
+        ast.AsyncWith,
+        ast.Try,
+        *((ast.TryStar,) if hasattr(ast, "TryStar") else ()),
+        ast.Match,
+    )
+
+    def handlers(self):
+        return dict.fromkeys(
+            self.block_types, lambda value, node, depth: max(value, depth + 1)
+        )
+
+
+@register_pass
+class StatementsPass(AnalysisPass):
+    name = "statements"
+    inclusive = True
+
+    def handlers(self):
+        return dict.fromkeys(ast.stmt.__subclasses__(), increment)
+
+
+@register_pass
+class AnnotationsPass(AnalysisPass):
+    name = "missing_annotations"
+
+    def start(self, node, owner):
+        arguments = node.args
+        args = [*arguments.posonlyargs, *arguments.args, *arguments.kwonlyargs]
+        args += [arg for arg in (arguments.vararg, arguments.kwarg) if arg]
+        if owner is not None and args and args[0].arg in ("self", "cls"):
+            args = args[1:]
+        missing = sum(arg.annotation is None for arg in args)
+        return missing + (node.returns is None)
+
+
+def node_types(base=ast.AST):
+    for node_type in base.__subclasses__():
+        yield node_type
+        yield from node_types(node_type)
+
+
+def child_count(node):
+    count = 0
+    for name in node._fields:
+        value = getattr(node, name, None)
+        if isinstance(value, ast.AST):
+            count += 1
+        elif isinstance(value, list):
+            count += sum(isinstance(item, ast.AST) for item in value)
+    return count
+
+
+# Hashes the pre-order sequence of (node type, child count, label) of a
+# function, which determines its subtree exactly. Equal hashes mark
+# duplicate functions without keeping any AST around.
+@register_pass
+class FingerprintPass(AnalysisPass):
+    name = "fingerprint"
+    default = False
+    inclusive = True
+    abstract = False
+    label_fields = {
+        ast.Name: "id",
+        ast.arg: "arg",
+        ast.Attribute: "attr",
+        ast.keyword: "arg",
+        ast.alias: "name",
+        ast.FunctionDef: "name",
+        ast.AsyncFunctionDef: "name",
+        ast.ClassDef: "name",
+        ast.Global: "names",
+        ast.Nonlocal: "names",
+        ast.ImportFrom: "module",
+    }
+
+    def start(self, node, owner):
+        return hashlib.blake2b(digest_size=8)
+
+    def finish(self, value):
+        return value.hexdigest()
+
+    def label(self, node_type):
+        if node_type is ast.Constant:
+            if self.abstract:
+                return lambda node: type(node.value).__name__
+            return lambda node: repr(node.value)
+        field_name = self.label_fields.get(node_type)
+        if field_name is None or self.abstract:
+            return lambda node: ""
+        return lambda node: str(getattr(node, field_name))
+
+    def handlers(self):
+        handlers = {}
+        for node_type in node_types():
+
+            def update(value, node, depth, label=self.label(node_type)):
+                value.update(
+                    f"{type(node).__name__}/{child_count(node)}/{label(node)};".encode()
+                )
+                return value
+
+            handlers[node_type] = update
+        return handlers
+
+
+# Same as fingerprint with identifiers and constants abstracted, so renamed
+# copies hash alike.
+@register_pass
+class AbstractFingerprintPass(FingerprintPass):
+    name = "fingerprint_abstract"
+    abstract = True
+
+
+_dispatch_by_passes = {}
+
+
+def analysis_dispatch(passes):
+    dispatch = _dispatch_by_passes.get(passes)
+    if dispatch is None:
+        dispatch = {}
+        for name in passes:
+            for node_type, handler in ANALYSIS_PASSES[name].handlers().items():
+                dispatch.setdefault(node_type, []).append((name, handler))
+        _dispatch_by_passes[passes] = dispatch
+    return dispatch
+
+
+DEFAULT_PASSES = [
+    name for name, analysis in ANALYSIS_PASSES.items() if analysis.default
+]
+
+
+# Stand-in when --profile is off; every hook is a shared no-op.
+class NullTimer:
+    _context = nullcontext()
+
+    def phase(self, name):
+        return self._context
+
+    def wrap(self, name, func):
+        return func
+
+    def add(self, phase, seconds, calls=1):
+        pass
+
+    def seconds(self, phase):
+        return 0.0
+
+
+NULL_TIMER = NullTimer()
+
+
+def unparse_args(args, unparse=ast.unparse):
+    return tuple(
+        (arg.arg, unparse(arg.annotation) if arg.annotation else None) for arg in args
+    )
+
+
+def count_lines(source):
+    return source.count("\n") + (1 if source and not source.endswith("\n") else 0)
+
+
+# Comments and string literals, so quotes inside them don't confuse the scan. A
+# lone quote means an unterminated string, in which case we let ast decide.
+STRING_SCANNER = re.compile(
+    r"#[^\n]*"
+    r'|"""(?:[^"\\]+|\\.|"(?!""))*"""'
+    r"|'''(?:[^'\\]+|\\.|'(?!''))*'''"
+    r'|"(?:[^"\\\n]+|\\.)*"'
+    r"|'(?:[^'\\\n]+|\\.)*'"
+    r"""|(?P<unterminated>["'])""",
+    re.S,
+)
+DEFINITION_LINE = re.compile(r"(?:(async)[ \t\f]+)?(def|class)\b")
+
+
+def count_definition_lines(text):
+    functions = 0
+    classes = 0
+    for line in text.split("\n"):
+        stripped = line.lstrip(" \t\f")
+        if not stripped.startswith(("def", "class", "async")):
+            continue
+        match = DEFINITION_LINE.match(stripped)
+        if match is None:
+            continue
+        if match.group(2) == "class":
+            classes += 1
+        elif match.group(1) is None:
+            functions += 1
+    return functions, classes
+
+
+# `def` and `class` are hard keywords that can only start a logical line, so every
+# line beginning with one is a definition unless it sits inside a multi-line
+# string. Only those strings need lexing; the candidates inside them are
+# subtracted again. Returns None if the file can't be classified with certainty.
+def count_definitions(source):
+    functions, classes = count_definition_lines(source)
+    if '"""' not in source and "'''" not in source and "\\\n" not in source:
+        return functions, classes
+
+    for match in STRING_SCANNER.finditer(source):
+        if match.lastgroup == "unterminated":
+            return None
+        start, end = match.span()
+        newline = source.find("\n", start, end)
+        if newline == -1:
+            continue
+        inner_functions, inner_classes = count_definition_lines(
+            source[newline + 1 : end]
+        )
+        functions -= inner_functions
+        classes -= inner_classes
+    return functions, classes
+
+
+def extract_from_source(source, filename="<unknown>", timer=NULL_TIMER, passes=()):
+    with timer.phase("parse"):
+        tree = ast.parse(source, filename=filename)
+
+    class_details = []
+    function_details = []
+    import_details = []
+    unparse = timer.wrap("unparse", ast.unparse)
+    unparse_before = timer.seconds("unparse")
+    t0 = time.perf_counter()
+    dispatch = analysis_dispatch(tuple(passes)) if passes else None
+    inclusive = analysis_dispatch(
+        tuple(name for name in passes if ANALYSIS_PASSES[name].inclusive)
+    )
+
+    # (node, enclosing ClassRecord if node sits directly in a class body,
+    #  metrics of the enclosing function when analysing, nesting depth,
+    #  metrics of the functions around that one)
+    frames = []
+    stack = [(tree, None, None, 0, ())]
+    while stack:
+        node, owner, metrics, depth, outer = stack.pop()
+        node_type = type(node)
+        child_owner = None
+        child_metrics = metrics
+        child_outer = outer
+
+        if metrics is not None:
+            for name, handler in dispatch.get(node_type, ()):
+                metrics[name] = handler(metrics[name], node, depth)
+            for frame in outer:
+                for name, handler in inclusive.get(node_type, ()):
+                    frame[name] = handler(frame[name], node, depth)
+
+        if node_type is ast.FunctionDef:
+            if dispatch is not None:
+                if metrics is not None:
+                    child_outer = (*outer, metrics)
+                child_metrics = {
+                    name: ANALYSIS_PASSES[name].start(node, owner) for name in passes
+                }
+                frames.append(child_metrics)
+            record = FunctionRecord(
+                node.name,
+                node.lineno,
+                unparse_args(node.args.args, unparse),
+                unparse(node.returns) if node.returns else None,
+                child_metrics,
+            )
+            if owner is not None:
+                owner.functions.append(record)
+            else:
+                function_details.append(record)
+        elif node_type is ast.ClassDef:
+            child_owner = ClassRecord(
+                node.name,
+                node.lineno,
+                tuple(unparse(base) for base in node.bases),
+                [],
+            )
+            class_details.append(child_owner)
+        elif node_type is ast.Import or node_type is ast.ImportFrom:
+            import_details.append(
+                ImportRecord(
+                    node.lineno,
+                    unparse(node),
+                    node.module if node_type is ast.ImportFrom else None,
+                    tuple(alias.name for alias in node.names),
+                    node.level if node_type is ast.ImportFrom else 0,
+                )
+            )
+
+        if child_metrics is None:
+            for name in reversed(block_fields(node_type)):
+                for child in reversed(getattr(node, name)):
+                    stack.append((child, child_owner, None, 0, ()))
+            continue
+
+        # Inside a function every node is visited so expression handlers fire.
+        if node_type is ast.FunctionDef:
+            child_depth = 0
+        else:
+            child_depth = depth + 1 if isinstance(node, ast.stmt) else depth
+        # An elif is the sole If in its parent's orelse; keep it at that depth.
+        elif_node = (
+            node.orelse[0]
+            if node_type is ast.If
+            and len(node.orelse) == 1
+            and type(node.orelse[0]) is ast.If
+            else None
+        )
+        for child in reversed(list(ast.iter_child_nodes(node))):
+            stack.append(
+                (
+                    child,
+                    child_owner,
+                    child_metrics,
+                    depth if child is elif_node else child_depth,
+                    child_outer,
+                )
+            )
+
+    for metrics in frames:
+        for name in passes:
+            metrics[name] = ANALYSIS_PASSES[name].finish(metrics[name])
+
+    # Reported exclusive of the unparse calls made during the walk.
+    timer.add(
+        "extract",
+        time.perf_counter() - t0 - (timer.seconds("unparse") - unparse_before),
+    )
+    return class_details, function_details, import_details
+
+
+def list_classes_and_functions(script_path, passes=(), *args, **kwargs):
+    with open(script_path, "r") as file:
+        return extract_from_source(file.read(), filename=script_path, passes=passes)
+
+
+def file_digest(file_path):
+    with open(file_path, "r") as file:
+        return hashlib.blake2b(file.read().encode(), digest_size=16).hexdigest()
+
+
+def process_file(
+    file_path,
+    with_digest=False,
+    counts_only=False,
+    profile=False,
+    passes=(),
+    *args,
+    **kwargs,
+):
+    timer = PhaseTimer() if profile else NULL_TIMER
+    timings = timer.phases if profile else None
+    try:
+        with timer.phase("read"):
+            with open(file_path, "r") as file:
+                source = file.read()
+
+        digest = None
+        if with_digest:
+            with timer.phase("digest"):
+                digest = hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+        if counts_only:
+            with timer.phase("scan"):
+                counts = count_definitions(source)
+            if counts is not None:
+                return FileSummary(
+                    file_path,
+                    count_lines(source),
+                    digest=digest,
+                    function_count=counts[0],
+                    class_count=counts[1],
+                    timings=timings,
+                )
+
+        class_details, function_details, import_details = extract_from_source(
+            source, filename=file_path, timer=timer, passes=passes
+        )
+        return FileSummary(
+            file_path,
+            count_lines(source),
+            class_details,
+            function_details,
+            import_details,
+            digest=digest,
+            timings=timings,
+            passes=tuple(passes),
+        )
+    except Exception as e:
+        return FileSummary(file_path, error=str(e), timings=timings)
+
+
+def process_blob(item, counts_only=False, passes=()):
+    file_path, data = item
+    try:
+        source = data.decode()
+        if counts_only:
+            counts = count_definitions(source)
+            if counts is not None:
+                return FileSummary(
+                    file_path,
+                    count_lines(source),
+                    function_count=counts[0],
+                    class_count=counts[1],
+                )
+        class_details, function_details, import_details = extract_from_source(
+            source, filename=file_path, passes=passes
+        )
+        return FileSummary(
+            file_path,
+            count_lines(source),
+            class_details,
+            function_details,
+            import_details,
+            passes=tuple(passes),
+        )
+    except Exception as e:
+        return FileSummary(file_path, error=str(e))
+
+
+def sort_file_summary(summary, reverse):
+    return replace(
+        summary,
+        class_details=sorted(
+            (
+                cls._replace(
+                    functions=sorted(
+                        cls.functions, key=lambda x: x.name, reverse=reverse
+                    )
+                )
+                for cls in summary.class_details
+            ),
+            key=lambda x: x.name,
+            reverse=reverse,
+        ),
+        function_details=sorted(
+            summary.function_details, key=lambda x: x.name, reverse=reverse
+        ),
+        import_details=sorted(
+            summary.import_details, key=lambda x: x.lineno, reverse=reverse
+        ),
+    )
+
+
+def default_cache_dir():
+    return os.environ.get(
+        "DS_AST_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ds_util")
+    )
+
+
+def default_cache_path():
+    return os.path.join(default_cache_dir(), "ast_explorer_cache.sqlite")
+
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    digest TEXT,
+    summary BLOB NOT NULL,
+    last_used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used);
+"""
+
+
+# Summaries are stored as plain tuples, so reading the cache never depends on
+# the module the record classes were defined in (__main__ or ast_explorer).
+def encode_summary(summary):
+    return marshal.dumps(
+        (
+            summary.lines,
+            tuple(
+                (*cls[:3], tuple(tuple(func) for func in cls.functions))
+                for cls in summary.class_details
+            ),
+            tuple(tuple(func) for func in summary.function_details),
+            tuple(tuple(imp) for imp in summary.import_details),
+            summary.digest,
+            summary.function_count,
+            summary.class_count,
+            summary.passes,
+        )
+    )
+
+
+def decode_summary(file_path, data):
+    (
+        lines,
+        classes,
+        functions,
+        imports,
+        digest,
+        function_count,
+        class_count,
+        passes,
+    ) = marshal.loads(data)
+    return FileSummary(
+        file_path,
+        lines,
+        [
+            ClassRecord(name, lineno, bases, [FunctionRecord(*f) for f in methods])
+            for name, lineno, bases, methods in classes
+        ],
+        [FunctionRecord(*func) for func in functions],
+        [ImportRecord(*imp) for imp in imports],
+        digest=digest,
+        function_count=function_count,
+        class_count=class_count,
+        passes=passes,
+    )
+
+
+# Entries stay valid while (mtime_ns, size) match the file on disk. With use_hash
+# a touched-but-identical file is still a hit by comparing content digests.
+# Only the scanned paths are read, and only new entries and the last_used of
+# hits are written back, so a small scan stays cheap however large the cache.
+class ParseCache:
+    def __init__(
+        self,
+        cache_path,
+        use_hash=False,
+        max_entries=DEFAULT_CACHE_MAX_ENTRIES,
+        rebuild=False,
+    ):
+        self.cache_path = cache_path
+        self.use_hash = use_hash
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # Runs are ordered by start time for least-recently-used eviction.
+        self.generation = time.time_ns()
+        # path -> (mtime_ns, size, digest, encoded summary) not yet written
+        self.pending = {}
+        # Paths hit this run, whose last_used is refreshed on flush.
+        self.used = []
+        self.connection = self.open(rebuild)
+
+    def open(self, rebuild):
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        try:
+            return self.connect(self.cache_path, rebuild)
+        except sqlite3.OperationalError as e:
+            # Locked or not writable: run without a persistent cache.
+            print(
+                Messages.error_cache.format(cache_path=self.cache_path, error=e),
+                file=sys.stderr,
+            )
+            return self.connect(":memory:", rebuild)
+        except sqlite3.DatabaseError as e:
+            # Never written over; it is kept aside and a fresh cache started.
+            backup_path = self.cache_path + ".unreadable"
+            os.replace(self.cache_path, backup_path)
+            print(
+                Messages.error_cache_moved.format(
+                    cache_path=self.cache_path, backup_path=backup_path, error=e
+                ),
+                file=sys.stderr,
+            )
+            return self.connect(self.cache_path, rebuild)
+
+    @staticmethod
+    def connect(path, rebuild):
+        connection = sqlite3.connect(path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(CACHE_SCHEMA)
+        version = json.dumps(CACHE_VERSION)
+        row = connection.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        # Records of another format or interpreter are dropped, never decoded.
+        if rebuild or row is None or row[0] != version:
+            with connection:
+                connection.execute("DELETE FROM entries")
+                connection.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,)
+                )
+        return connection
+
+    def lookup(self, file_path, stat, counts_only=False, passes=()):
+        key = os.path.abspath(file_path)
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = self.connection.execute(
+                "SELECT mtime_ns, size, digest, summary FROM entries WHERE path = ?",
+                (key,),
+            ).fetchone()
+        if entry is not None:
+            mtime_ns, size, digest, data = entry
+            summary = decode_summary(file_path, data)
+            if not summary.satisfies(counts_only, passes):
+                hit = False
+            elif mtime_ns == stat.st_mtime_ns and size == stat.st_size:
+                hit = True
+            elif self.use_hash and digest is not None and size == stat.st_size:
+                hit = file_digest(file_path) == digest
+            else:
+                hit = False
+            if hit:
+                self.hits += 1
+                if mtime_ns != stat.st_mtime_ns:
+                    self.pending[key] = (stat.st_mtime_ns, stat.st_size, digest, data)
+                else:
+                    self.used.append(key)
+                # Passes cached by an earlier, wider run are not reported.
+                return summary.with_metrics(passes)
+        self.misses += 1
+        return None
+
+    def store(self, stat, summary):
+        if summary.error is not None:
+            return
+        self.pending[os.path.abspath(summary.file_path)] = (
+            stat.st_mtime_ns,
+            stat.st_size,
+            summary.digest,
+            encode_summary(summary),
+        )
+        # Keeps a long --stream run from holding every new entry until save().
+        if len(self.pending) >= CACHE_FLUSH_ENTRIES:
+            self.flush()
+
+    def flush(self):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (path, *entry, self.generation)
+                    for path, entry in self.pending.items()
+                ),
+            )
+            self.connection.executemany(
+                "UPDATE entries SET last_used = ? WHERE path = ?",
+                ((self.generation, path) for path in self.used),
+            )
+        self.pending.clear()
+        self.used.clear()
+
+    def entry_count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def evict(self):
+        excess = self.entry_count() - self.max_entries
+        if excess <= 0:
+            return
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM entries WHERE path IN "
+                "(SELECT path FROM entries ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def save(self):
+        self.flush()
+        self.evict()
+
+
+class RecordWriter:
+    def __init__(self, output_format, stream=None):
+        self.output_format = output_format
+        # One large binary buffer instead of a text-layer write per print().
+        self.stream = stream or open(
+            sys.stdout.fileno(), "wb", buffering=1 << 16, closefd=False
+        )
+        self.encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+        self.records = 0
+
+    def write(self, record):
+        line = self.encode(record).encode()
+        if self.output_format == "json":
+            self.stream.write(b"[\n" if self.records == 0 else b",\n")
+            self.stream.write(line)
+        else:
+            self.stream.write(line + b"\n")
+        self.records += 1
+
+    def close(self):
+        if self.output_format == "json":
+            self.stream.write(b"[]\n" if self.records == 0 else b"\n]\n")
+        self.stream.flush()
+
+
+def function_record(path, class_name, func):
+    record = {
+        "type": "function",
+        "path": path,
+        "class": class_name,
+        "name": func.name,
+        "lineno": func.lineno,
+        "args": [
+            {"name": arg, "annotation": annotation} for arg, annotation in func.args
+        ],
+        "returns": func.return_type,
+    }
+    if func.metrics is not None:
+        record["metrics"] = func.metrics
+    return record
+
+
+def write_file_records(
+    writer,
+    summary,
+    sort_items,
+    sort_desc,
+    header_only,
+    show_imports,
+    summary_only,
+    *args,
+    **kwargs,
+):
+    path = os.path.abspath(summary.file_path)
+    if summary.error is not None:
+        writer.write({"type": "error", "path": path, "error": summary.error})
+        return 0, 0, 0
+
+    if sort_items or sort_desc:
+        summary = sort_file_summary(summary, reverse=sort_desc)
+
+    if not summary_only:
+        writer.write(
+            {
+                "type": "file",
+                "path": path,
+                "lines": summary.lines,
+                "functions": summary.functions,
+                "classes": summary.classes,
+            }
+        )
+        if show_imports:
+            for record in summary.import_details:
+                writer.write(
+                    {
+                        "type": "import",
+                        "path": path,
+                        "lineno": record.lineno,
+                        "statement": record.statement,
+                        "module": record.module,
+                        "names": list(record.names),
+                        "level": record.level,
+                    }
+                )
+        if not header_only:
+            for cls in summary.class_details:
+                writer.write(
+                    {
+                        "type": "class",
+                        "path": path,
+                        "name": cls.name,
+                        "lineno": cls.lineno,
+                        "bases": list(cls.bases),
+                    }
+                )
+                for func in cls.functions:
+                    writer.write(function_record(path, cls.name, func))
+            for func in summary.function_details:
+                writer.write(function_record(path, None, func))
+
+    return summary.lines, summary.functions, summary.classes
+
+
+def report_file(
+    summary,
+    sort_items,
+    sort_desc,
+    header_only,
+    show_imports,
+    line_links,
+    summary_only,
+    writer=None,
+    shown_passes=None,
+):
+    # Passes computed only for collectors stay out of the listing.
+    if shown_passes is not None:
+        summary = summary.with_metrics(shown_passes)
+    if writer is not None:
+        return write_file_records(
+            writer,
+            summary,
+            sort_items,
+            sort_desc,
+            header_only,
+            show_imports,
+            summary_only,
+        )
+    return print_file_summary(
+        summary,
+        sort_items,
+        sort_desc,
+        header_only,
+        show_imports,
+        line_links,
+        summary_only,
+    )
+
+
+def report_summary(
+    total_files, total_lines, total_functions, total_classes, path=None, writer=None
+):
+    if writer is not None:
+        writer.write(
+            {
+                "type": "summary",
+                "path": path and os.path.abspath(path),
+                "files": total_files,
+                "lines": total_lines,
+                "functions": total_functions,
+                "classes": total_classes,
+            }
+        )
+        return
+    print(
+        Messages.summary.format(
+            total_files=total_files,
+            total_lines=total_lines,
+            total_functions=total_functions,
+            total_classes=total_classes,
+        )
+    )
+
+
+def vscode_link(file_path, lineno):
+    return f" (vscode://file/{os.path.abspath(file_path)}:{lineno})"
+
+
+def format_metrics(metrics):
+    if not metrics:
+        return ""
+    values = " ".join(f"{name}={value}" for name, value in metrics.items())
+    return colored(f" [{values}]", Colors.metrics)
+
+
+def print_file_summary(
+    summary,
+    sort_items,
+    sort_desc,
+    header_only,
+    show_imports,
+    line_links,
+    summary_only,
+    *args,
+    **kwargs,
+):
+    if summary.error is not None:
+        print(
+            Messages.error_processing.format(
+                file_path=summary.file_path, error=summary.error
+            ),
+            file=sys.stderr,
+        )
+        return 0, 0, 0
+
+    if sort_items or sort_desc:
+        summary = sort_file_summary(summary, reverse=sort_desc)
+
+    file_path = summary.file_path
+    if not summary_only:
+        print(
+            Messages.filepath_details.format(
+                file_path=colored(os.path.abspath(file_path), Colors.filepath),
+                lines=summary.lines,
+                functions=summary.functions,
+                classes=summary.classes,
+            )
+        )
+
+        if show_imports:
+            for record in summary.import_details:
+                print(f"{record.lineno:6} {record.statement}")
+
+        if not header_only:
+            for cls in summary.class_details:
+                base_classes = f"({', '.join(cls.bases)})" if cls.bases else ""
+                class_name = f"{colored(cls.name, Colors.classname)}{base_classes}"
+                print(
+                    Messages.class_header.format(
+                        lineno=cls.lineno, class_name=class_name
+                    )
+                )
+                for func in cls.functions:
+                    args_with_hints = ", ".join(
+                        f"{colored(arg, Colors.argname)}{': ' + annotation if annotation and arg != 'self' else ''}"
+                        for arg, annotation in func.args
+                        if not (arg == "self" and not annotation)
+                    )
+                    return_type = func.return_type if func.return_type else "None"
+                    function_name = f"{colored(func.name, Colors.functionname)}"
+                    link = vscode_link(file_path, func.lineno) if line_links else ""
+                    print(
+                        Messages.function_detail.format(
+                            lineno=func.lineno,
+                            function_name=function_name,
+                            args_with_hints=args_with_hints,
+                            return_type=return_type,
+                            metrics=format_metrics(func.metrics),
+                            link=link,
+                        )
+                    )
+
+            for func in summary.function_details:
+                args_with_hints = ", ".join(
+                    f"{colored(arg, Colors.argname)}: {annotation if annotation and arg != 'self' else ''}"
+                    for arg, annotation in func.args
+                    if not (arg == "self" and not annotation)
+                )
+                return_type = func.return_type if func.return_type else "None"
+                function_name = f"{colored(func.name, Colors.functionname)}"
+                link = vscode_link(file_path, func.lineno) if line_links else ""
+                print(
+                    Messages.standalone_function.format(
+                        lineno=func.lineno,
+                        function_name=function_name,
+                        args_with_hints=args_with_hints,
+                        return_type=return_type,
+                        metrics=format_metrics(func.metrics),
+                        link=link,
+                    )
+                )
+
+    return summary.lines, summary.functions, summary.classes
+
+
+def iter_python_files(directory, recursive=False, max_depth=None, skip_dirs=()):
+    def _walk(current_dir, depth):
+        try:
+            with os.scandir(current_dir) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            print(
+                Messages.error_listing.format(directory=current_dir, error=e),
+                file=sys.stderr,
+            )
+            return
+
+        subdirs = []
+        for entry in entries:
+            if entry.name.endswith(".py") and entry.is_file():
+                yield entry.path
+            elif recursive and entry.is_dir(follow_symlinks=False):
+                if not any(fnmatch.fnmatch(entry.name, pat) for pat in skip_dirs):
+                    subdirs.append(entry.path)
+
+        if max_depth is not None and depth >= max_depth:
+            return
+        for subdir in subdirs:
+            yield from _walk(subdir, depth + 1)
+
+    return _walk(directory, 0)
+
+
+def find_python_files(directory, recursive=False, max_depth=None, skip_dirs=()):
+    return list(iter_python_files(directory, recursive, max_depth, skip_dirs))
+
+
+def parallel_map(worker, items, executor):
+    if executor is None or len(items) < MIN_PARALLEL_FILES:
+        return map(worker, items)
+    chunksize = max(1, len(items) // ((os.cpu_count() or 1) * 8))
+    return executor.map(worker, items, chunksize=chunksize)
+
+
+def map_chunk(worker, items):
+    return [worker(item) for item in items]
+
+
+# Ordered map over (context, items) batches with at most `window` batches in
+# flight, so a slow consumer stalls the producer instead of piling up results.
+# Without an executor each batch is computed when it is consumed.
+def bounded_map(worker, batches, executor=None, window=1):
+    pending = deque()
+
+    def _result(work):
+        if isinstance(work, list):
+            return map_chunk(worker, work)
+        return work.result()
+
+    for context, items in batches:
+        if executor is not None and items:
+            pending.append((context, executor.submit(map_chunk, worker, items)))
+        else:
+            pending.append((context, items))
+        if len(pending) >= window:
+            context, work = pending.popleft()
+            yield context, _result(work)
+    while pending:
+        context, work = pending.popleft()
+        yield context, _result(work)
+
+
+def chunked(items, size):
+    items = iter(items)
+    while chunk := list(itertools.islice(items, size)):
+        yield chunk
+
+
+def stream_window(max_in_flight):
+    return max(1, max_in_flight // STREAM_CHUNK_SIZE)
+
+
+# Generator counterpart of scan_files for --stream: file_paths may be lazy,
+# and only max_in_flight files (paths, stats and summaries) are held at once.
+def stream_files(
+    file_paths,
+    executor=None,
+    cache=None,
+    counts_only=False,
+    profiler=None,
+    passes=(),
+    max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+):
+    worker = partial(
+        process_file,
+        with_digest=cache is not None and cache.use_hash,
+        counts_only=counts_only,
+        profile=profiler is not None,
+        passes=passes,
+    )
+    lookup = None
+    if cache is not None:
+        lookup = cache.lookup
+        if profiler is not None:
+            lookup = profiler.timer.wrap("cache", cache.lookup)
+
+    def _batches():
+        for chunk in chunked(file_paths, STREAM_CHUNK_SIZE):
+            batch = []
+            for file_path in chunk:
+                stat = summary = None
+                if lookup is not None:
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError:
+                        pass
+                    else:
+                        summary = lookup(file_path, stat, counts_only, passes)
+                batch.append((file_path, stat, summary))
+            yield batch, [
+                file_path for file_path, _, summary in batch if summary is None
+            ]
+
+    window = stream_window(max_in_flight)
+    for batch, parsed in bounded_map(worker, _batches(), executor, window):
+        parsed = iter(parsed)
+        for file_path, stat, summary in batch:
+            if summary is None:
+                summary = next(parsed)
+                if stat is not None:
+                    cache.store(stat, summary)
+            yield summary
+
+
+def map_files(
+    file_paths,
+    executor,
+    with_digest=False,
+    counts_only=False,
+    profile=False,
+    passes=(),
+):
+    worker = partial(
+        process_file,
+        with_digest=with_digest,
+        counts_only=counts_only,
+        profile=profile,
+        passes=passes,
+    )
+    return parallel_map(worker, file_paths, executor)
+
+
+def scan_files(
+    file_paths,
+    executor=None,
+    cache=None,
+    counts_only=False,
+    profiler=None,
+    passes=(),
+):
+    profile = profiler is not None
+    if cache is None:
+        yield from map_files(
+            file_paths,
+            executor,
+            counts_only=counts_only,
+            profile=profile,
+            passes=passes,
+        )
+        return
+
+    lookup = cache.lookup if not profile else profiler.timer.wrap("cache", cache.lookup)
+
+    stats = []
+    cached = []
+    misses = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            stat = None
+        summary = (
+            lookup(file_path, stat, counts_only, passes) if stat is not None else None
+        )
+        stats.append(stat)
+        cached.append(summary)
+        if summary is None:
+            misses.append(file_path)
+
+    parsed = map_files(
+        misses,
+        executor,
+        with_digest=cache.use_hash,
+        counts_only=counts_only,
+        profile=profile,
+        passes=passes,
+    )
+    for stat, summary in zip(stats, cached):
+        if summary is None:
+            summary = next(parsed)
+            if stat is not None:
+                cache.store(stat, summary)
+        yield summary
+
+
+# Parent-side aggregation for --profile. Worker phases arrive through
+# FileSummary.timings; cache lookups and output are timed here.
+class Profiler:
+    def __init__(self, top):
+        self.timer = PhaseTimer()
+        self.top = top
+        self.slowest = []
+        self.files = 0
+        self.t0 = time.perf_counter()
+
+    def record_file(self, summary, output_seconds):
+        self.files += 1
+        phases = summary.timings or {}
+        self.timer.merge(phases)
+        self.timer.add("output", output_seconds)
+        total = output_seconds + sum(seconds for seconds, _ in phases.values())
+        item = (total, summary.file_path)
+        if len(self.slowest) < self.top:
+            heapq.heappush(self.slowest, item)
+        elif self.top:
+            heapq.heappushpop(self.slowest, item)
+
+    def to_dict(self):
+        return {
+            "wall_seconds": time.perf_counter() - self.t0,
+            "files": self.files,
+            "phases": {
+                phase: {"seconds": seconds, "calls": calls}
+                for phase, (seconds, calls) in self.timer.phases.items()
+            },
+            "slowest_files": [
+                {"path": file_path, "seconds": seconds}
+                for seconds, file_path in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+    def print_report(self, file=None):
+        # Resolved per call so a redirected stderr (the watch daemon) is honoured.
+        if file is None:
+            file = sys.stderr
+        profile = self.to_dict()
+        accounted = sum(phase["seconds"] for phase in profile["phases"].values())
+        print(
+            Messages.profile_header.format(
+                phase="Phase",
+                calls="Calls",
+                seconds="Total s",
+                mean="Mean ms",
+                share="Share",
+            ),
+            file=file,
+        )
+        for phase, entry in sorted(
+            profile["phases"].items(), key=lambda item: -item[1]["seconds"]
+        ):
+            print(
+                Messages.profile_row.format(
+                    phase=phase,
+                    calls=entry["calls"],
+                    seconds=entry["seconds"],
+                    mean=(
+                        entry["seconds"] / entry["calls"] * 1e3 if entry["calls"] else 0
+                    ),
+                    share=entry["seconds"] / accounted * 100 if accounted else 0,
+                ),
+                file=file,
+            )
+        print(
+            f"Wall time {profile['wall_seconds']:.4f}s for {profile['files']} files",
+            file=file,
+        )
+        if profile["slowest_files"]:
+            print(f"\nSlowest {len(profile['slowest_files'])} files:", file=file)
+            for entry in profile["slowest_files"]:
+                print(
+                    Messages.profile_file.format(
+                        seconds=entry["seconds"], file_path=entry["path"]
+                    ),
+                    file=file,
+                )
+
+
+def iter_functions(summary):
+    for func in summary.function_details:
+        yield None, func
+    for cls in summary.class_details:
+        for func in cls.functions:
+            yield cls.name, func
+
+
+def qualified_name(class_name, func):
+    return f"{class_name}.{func.name}" if class_name else func.name
+
+
+# Keeps the --top worst functions across the whole scan in a bounded heap.
+class FunctionRanking:
+    def __init__(self, top, metric, shown_passes=None):
+        self.top = top
+        self.metric = metric
+        self.shown_passes = shown_passes
+        self.heap = []
+        self.seen = 0
+
+    def add(self, summary):
+        for class_name, func in iter_functions(summary):
+            if func.metrics is None:
+                continue
+            # seen breaks ties in favour of the function found first.
+            self.seen += 1
+            item = (
+                func.metrics[self.metric],
+                -self.seen,
+                summary.file_path,
+                class_name,
+                func,
+            )
+            if len(self.heap) < self.top:
+                heapq.heappush(self.heap, item)
+            elif self.top:
+                heapq.heappushpop(self.heap, item)
+
+    def report(self, line_links=False, writer=None):
+        ranked = sorted(self.heap, reverse=True)
+        if self.shown_passes is not None:
+            ranked = [
+                (*item[:4], restrict_metrics(item[4], self.shown_passes))
+                for item in ranked
+            ]
+        if writer is not None:
+            for rank, (value, _, file_path, class_name, func) in enumerate(ranked, 1):
+                record = function_record(os.path.abspath(file_path), class_name, func)
+                record.update(
+                    type="ranking", rank=rank, metric=self.metric, value=value
+                )
+                writer.write(record)
+            return
+        print(Messages.ranking_header.format(count=len(ranked), metric=self.metric))
+        for value, _, file_path, class_name, func in ranked:
+            name = qualified_name(class_name, func)
+            print(
+                Messages.ranking_row.format(
+                    value=value,
+                    function_name=f"{os.path.abspath(file_path)}:{func.lineno} "
+                    f"{colored(name, Colors.functionname)}",
+                    metrics=format_metrics(func.metrics).lstrip(),
+                    link=vscode_link(file_path, func.lineno) if line_links else "",
+                )
+            )
+
+
+# Hash index over function fingerprints: one dict insert per function, so
+# clusters come out in linear time instead of by pairwise comparison.
+class DuplicateIndex:
+    def __init__(self, fingerprint, min_statements):
+        self.fingerprint = fingerprint
+        self.min_statements = min_statements
+        # fingerprint -> [(file_path, class_name, FunctionRecord)]
+        self.index = {}
+
+    def add(self, summary):
+        for class_name, func in iter_functions(summary):
+            if func.metrics is None:
+                continue
+            if func.metrics["statements"] < self.min_statements:
+                continue
+            self.index.setdefault(func.metrics[self.fingerprint], []).append(
+                (summary.file_path, class_name, func)
+            )
+
+    def clusters(self):
+        clusters = [
+            (fingerprint, members)
+            for fingerprint, members in self.index.items()
+            if len(members) > 1
+        ]
+        clusters.sort(
+            key=lambda cluster: (
+                -len(cluster[1]),
+                -cluster[1][0][2].metrics["statements"],
+                cluster[0],
+            )
+        )
+        return clusters
+
+    def report(self, line_links=False, writer=None):
+        clusters = self.clusters()
+        if writer is not None:
+            for fingerprint, members in clusters:
+                writer.write(
+                    {
+                        "type": "duplicate",
+                        "fingerprint": fingerprint,
+                        "statements": members[0][2].metrics["statements"],
+                        "functions": [
+                            {
+                                "path": os.path.abspath(file_path),
+                                "class": class_name,
+                                "name": func.name,
+                                "lineno": func.lineno,
+                            }
+                            for file_path, class_name, func in members
+                        ],
+                    }
+                )
+            return
+        print(
+            Messages.duplicates_header.format(
+                clusters=len(clusters),
+                functions=sum(len(members) for _, members in clusters),
+                mode=self.fingerprint,
+            )
+        )
+        for fingerprint, members in clusters:
+            print(
+                Messages.duplicate_cluster.format(
+                    count=len(members),
+                    statements=members[0][2].metrics["statements"],
+                    fingerprint=fingerprint,
+                )
+            )
+            for file_path, class_name, func in members:
+                name = colored(qualified_name(class_name, func), Colors.functionname)
+                print(
+                    Messages.duplicate_member.format(
+                        function_name=f"{os.path.abspath(file_path)}:{func.lineno} {name}",
+                        link=vscode_link(file_path, func.lineno) if line_links else "",
+                    )
+                )
+
+
+def report_summaries(
+    summaries,
+    sort_items,
+    sort_desc,
+    header_only,
+    show_imports,
+    line_links,
+    summary_only,
+    path=None,
+    writer=None,
+    profiler=None,
+    collectors=(),
+    shown_passes=None,
+):
+    total_files = 0
+    total_lines = 0
+    total_functions = 0
+    total_classes = 0
+
+    for summary in summaries:
+        t0 = time.perf_counter()
+        lines, functions, classes = report_file(
+            summary,
+            sort_items,
+            sort_desc,
+            header_only,
+            show_imports,
+            line_links,
+            summary_only,
+            writer,
+            shown_passes,
+        )
+        if profiler is not None:
+            profiler.record_file(summary, time.perf_counter() - t0)
+        for collector in collectors:
+            collector.add(summary)
+        total_files += 1
+        total_lines += lines
+        total_functions += functions
+        total_classes += classes
+
+    if not summary_only:
+        report_summary(
+            total_files,
+            total_lines,
+            total_functions,
+            total_classes,
+            path=path,
+            writer=writer,
+        )
+
+    return total_files, total_lines, total_functions, total_classes
+
+
+def process_directory(
+    directory,
+    sort_items,
+    sort_desc,
+    header_only,
+    show_imports,
+    line_links,
+    summary_only,
+    recursive=False,
+    max_depth=None,
+    skip_dirs=DEFAULT_SKIP_DIRS,
+    executor=None,
+    cache=None,
+    writer=None,
+    profiler=None,
+    passes=(),
+    collectors=(),
+    max_in_flight=None,
+    shown_passes=None,
+    *args,
+    **kwargs,
+):
+    counts_only = not passes and (summary_only or (header_only and not show_imports))
+    if max_in_flight is not None:
+        summaries = stream_files(
+            iter_python_files(directory, recursive, max_depth, skip_dirs),
+            executor,
+            cache,
+            counts_only,
+            profiler,
+            passes,
+            max_in_flight,
+        )
+    else:
+        file_paths = find_python_files(directory, recursive, max_depth, skip_dirs)
+        summaries = scan_files(
+            file_paths, executor, cache, counts_only, profiler, passes
+        )
+    return report_summaries(
+        summaries,
+        sort_items,
+        sort_desc,
+        header_only,
+        show_imports,
+        line_links,
+        summary_only,
+        path=directory,
+        writer=writer,
+        profiler=profiler,
+        collectors=collectors,
+        shown_passes=shown_passes,
+    )
+
+
+def is_archive(path):
+    return path.endswith(ARCHIVE_SUFFIXES + TAR_SUFFIXES)
+
+
+# (<archive>/<member>, source bytes) for every .py member, read straight from
+# the archive stream; nothing is extracted to disk. Zip members come sorted,
+# tar members in stream order; only the non-streaming path sorts those, since
+# reordering a compressed tar means holding or re-reading the whole archive.
+def iter_archive_members(archive_path):
+    if archive_path.endswith(TAR_SUFFIXES):
+        with tarfile.open(archive_path, "r:*") as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith(".py"):
+                    yield (
+                        os.path.join(archive_path, member.name),
+                        archive.extractfile(member).read(),
+                    )
+    else:
+        with zipfile.ZipFile(archive_path) as archive:
+            infos = sorted(archive.infolist(), key=lambda info: info.filename)
+            for info in infos:
+                if not info.is_dir() and info.filename.endswith(".py"):
+                    yield os.path.join(archive_path, info.filename), archive.read(info)
+
+
+def read_archive_members(archive_path):
+    return sorted(iter_archive_members(archive_path), key=lambda member: member[0])
+
+
+def process_archive(
+    archive_path,
+    sort_items,
+    sort_desc,
+    header_only,
+    show_imports,
+    line_links,
+    summary_only,
+    executor=None,
+    writer=None,
+    profiler=None,
+    passes=(),
+    collectors=(),
+    max_in_flight=None,
+    shown_passes=None,
+    *args,
+    **kwargs,
+):
+    counts_only = not passes and (summary_only or (header_only and not show_imports))
+    worker = partial(process_blob, counts_only=counts_only, passes=passes)
+
+    def _members():
+        try:
+            yield from iter_archive_members(archive_path)
+        except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+            print(
+                Messages.error_processing.format(file_path=archive_path, error=e),
+                file=sys.stderr,
+            )
+
+    if max_in_flight is not None:
+        batches = ((None, chunk) for chunk in chunked(_members(), STREAM_CHUNK_SIZE))
+        summaries = (
+            summary
+            for _, chunk in bounded_map(
+                worker, batches, executor, stream_window(max_in_flight)
+            )
+            for summary in chunk
+        )
+    else:
+        members = sorted(_members(), key=lambda member: member[0])
+        summaries = parallel_map(worker, members, executor)
+    return report_summaries(
+        summaries,
+        sort_items,
+        sort_desc,
+        header_only,
+        show_imports,
+        line_links,
+        summary_only,
+        path=archive_path,
+        writer=writer,
+        profiler=profiler,
+        collectors=collectors,
+        shown_passes=shown_passes,
+    )
+
+
+def package_root(directory):
+    directory = os.path.abspath(directory)
+    while os.path.isfile(os.path.join(directory, "__init__.py")):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+    return directory
+
+
+# Every directory below the scanned root counts as a package, so namespace
+# packages in monorepos resolve too.
+def module_name(file_path, root):
+    relative = os.path.relpath(os.path.abspath(file_path), root)
+    parts = relative[: -len(".py")].split(os.sep)
+    if parts[-1] == "__init__":
+        parts.pop()
+    return ".".join(parts)
+
+
+class ImportGraph:
+    def __init__(self):
+        self.names = []
+        self.paths = []
+        self.index = {}
+        self.is_package = []
+        self.imports = []
+        # For src/ layouts: "pkg.mod" also resolves "src.pkg.mod" when unique.
+        self.by_suffix = {}
+        self.adjacency = []
+
+    def add_module(self, name, file_path, import_details):
+        if name in self.index:
+            return
+        self.index[name] = len(self.names)
+        self.names.append(name)
+        self.paths.append(file_path)
+        self.is_package.append(file_path.endswith("__init__.py"))
+        self.imports.append(import_details)
+
+    def lookup(self, name):
+        node = self.index.get(name)
+        if node is None:
+            node = self.by_suffix.get(name)
+        return node
+
+    def resolve_deepest(self, dotted):
+        parts = dotted.split(".")
+        while parts:
+            node = self.lookup(".".join(parts))
+            if node is not None:
+                return node
+            parts.pop()
+        return None
+
+    def resolve_targets(self, node, record):
+        if record.module is None and record.level == 0:
+            for name in record.names:
+                yield self.resolve_deepest(name)
+            return
+
+        if record.level:
+            package = self.names[node].split(".")
+            if not self.is_package[node]:
+                package.pop()
+            if record.level > 1:
+                package = package[: len(package) - (record.level - 1)]
+            base = ".".join(package + ([record.module] if record.module else []))
+        else:
+            base = record.module
+
+        for name in record.names:
+            submodule = f"{base}.{name}" if base else name
+            target = self.lookup(submodule) if name != "*" else None
+            yield target if target is not None else self.resolve_deepest(base)
+
+    def build(self):
+        for name, node in self.index.items():
+            parts = name.split(".")
+            for start in range(1, len(parts)):
+                suffix = ".".join(parts[start:])
+                if suffix in self.index:
+                    continue
+                # None marks a suffix shared by several modules.
+                self.by_suffix[suffix] = node if suffix not in self.by_suffix else None
+
+        self.adjacency = []
+        for node, import_details in enumerate(self.imports):
+            targets = set()
+            for record in import_details:
+                for target in self.resolve_targets(node, record):
+                    if target is not None and target != node:
+                        targets.add(target)
+            self.adjacency.append(sorted(targets, key=self.names.__getitem__))
+        self.imports = None
+
+    def edge_count(self):
+        return sum(len(targets) for targets in self.adjacency)
+
+    def fan_in(self):
+        counts = [0] * len(self.names)
+        for targets in self.adjacency:
+            for target in targets:
+                counts[target] += 1
+        return counts
+
+    # Iterative Tarjan, so deep import chains can't hit the recursion limit.
+    def strongly_connected_components(self):
+        index_of = [-1] * len(self.names)
+        lowlink = [0] * len(self.names)
+        on_stack = [False] * len(self.names)
+        stack = []
+        components = []
+        counter = 0
+
+        for start in range(len(self.names)):
+            if index_of[start] != -1:
+                continue
+            work = [(start, 0)]
+            while work:
+                node, child = work.pop()
+                if child == 0:
+                    index_of[node] = lowlink[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack[node] = True
+                targets = self.adjacency[node]
+                while child < len(targets):
+                    target = targets[child]
+                    child += 1
+                    if index_of[target] == -1:
+                        work.append((node, child))
+                        work.append((target, 0))
+                        break
+                    if on_stack[target]:
+                        lowlink[node] = min(lowlink[node], index_of[target])
+                else:
+                    if lowlink[node] == index_of[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack[member] = False
+                            component.append(member)
+                            if member == node:
+                                break
+                        components.append(component)
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+        return components
+
+    def cycles(self):
+        return sorted(
+            (
+                sorted(self.names[member] for member in component)
+                for component in self.strongly_connected_components()
+                if len(component) > 1
+            ),
+            key=lambda members: (-len(members), members),
+        )
+
+    # Breadth-first, so every module is reported with its shortest import chain.
+    def closure(self, start):
+        parent = {start: None}
+        depth = {start: 0}
+        order = [start]
+        for node in order:
+            for target in self.adjacency[node]:
+                if target not in parent:
+                    parent[target] = node
+                    depth[target] = depth[node] + 1
+                    order.append(target)
+        return order, parent, depth
+
+    def import_chain(self, parent, node):
+        chain = []
+        while node is not None:
+            chain.append(self.names[node])
+            node = parent[node]
+        return chain[::-1]
+
+    def write_dot(self, stream, cycles):
+        in_cycle = {name for members in cycles for name in members}
+        stream.write("digraph imports {\n")
+        for node, name in enumerate(self.names):
+            style = ' [color="red"]' if name in in_cycle else ""
+            stream.write(f"    {json.dumps(name)}{style};\n")
+        for node, targets in enumerate(self.adjacency):
+            for target in targets:
+                style = (
+                    ' [color="red"]'
+                    if self.names[node] in in_cycle and self.names[target] in in_cycle
+                    else ""
+                )
+                stream.write(
+                    f"    {json.dumps(self.names[node])}"
+                    f" -> {json.dumps(self.names[target])}{style};\n"
+                )
+        stream.write("}\n")
+
+    def write_json(self, stream, cycles):
+        fan_in = self.fan_in()
+        json.dump(
+            {
+                "modules": [
+                    {
+                        "name": name,
+                        "path": self.paths[node],
+                        "fan_in": fan_in[node],
+                        "fan_out": len(self.adjacency[node]),
+                        "imports": [self.names[t] for t in self.adjacency[node]],
+                    }
+                    for node, name in enumerate(self.names)
+                ],
+                "cycles": cycles,
+            },
+            stream,
+            indent=1,
+        )
+        stream.write("\n")
+
+
+def build_import_graph(roots_and_files, executor=None, cache=None):
+    graph = ImportGraph()
+    for root, file_paths in roots_and_files:
+        for summary in scan_files(file_paths, executor, cache):
+            if summary.error is not None:
+                print(
+                    Messages.error_processing.format(
+                        file_path=summary.file_path, error=summary.error
+                    ),
+                    file=sys.stderr,
+                )
+                continue
+            graph.add_module(
+                module_name(summary.file_path, root),
+                os.path.abspath(summary.file_path),
+                summary.import_details,
+            )
+    graph.build()
+    return graph
+
+
+def report_import_graph(graph, output_format, top, closure_module=None):
+    cycles = graph.cycles()
+    if output_format == "dot":
+        graph.write_dot(sys.stdout, cycles)
+        return
+    if output_format == "json":
+        graph.write_json(sys.stdout, cycles)
+        return
+
+    print(
+        Messages.graph_header.format(
+            modules=len(graph.names), imports=graph.edge_count(), cycles=len(cycles)
+        )
+    )
+    if cycles:
+        print("\nImport cycles:")
+        for members in cycles:
+            print(
+                Messages.graph_cycle.format(
+                    size=len(members),
+                    members=" <-> ".join(colored(m, Colors.classname) for m in members),
+                )
+            )
+
+    fan_in = graph.fan_in()
+    for title, counts in (
+        ("Fan-in", fan_in),
+        ("Fan-out", [len(targets) for targets in graph.adjacency]),
+    ):
+        print(f"\n{title}:")
+        ranked = sorted(range(len(counts)), key=lambda node: (-counts[node], node))
+        for node in ranked[:top]:
+            print(
+                Messages.graph_rank.format(
+                    count=counts[node],
+                    module=colored(graph.names[node], Colors.filepath),
+                )
+            )
+
+    if closure_module is not None:
+        order, parent, depth = graph.closure(graph.index[closure_module])
+        print(f"\nTransitive imports of {closure_module} ({len(order) - 1} modules):")
+        for node in order[1:]:
+            chain = graph.import_chain(parent, node)
+            print(
+                Messages.graph_closure.format(
+                    depth=depth[node],
+                    module=colored(graph.names[node], Colors.filepath),
+                    chain=f" ({' -> '.join(chain[:-1])})" if len(chain) > 2 else "",
+                )
+            )
+
+
+# Reads revisions straight from the object store through one long-running
+# `git cat-file --batch`. Tree listings and summaries are kept by object id,
+# so subtrees and files that did not change between revisions are listed
+# and parsed once.
+class GitRevisionScanner:
+    def __init__(
+        self,
+        path,
+        executor=None,
+        recursive=False,
+        max_depth=None,
+        skip_dirs=DEFAULT_SKIP_DIRS,
+        passes=(),
+    ):
+        directory = path if os.path.isdir(path) else os.path.dirname(path) or "."
+        self.toplevel = subprocess.run(
+            ["git", "-C", directory, "rev-parse", "--show-toplevel"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        self.executor = executor
+        self.recursive = recursive
+        self.max_depth = max_depth
+        self.skip_dirs = skip_dirs
+        self.passes = passes
+        self.process = subprocess.Popen(
+            ["git", "-C", self.toplevel, "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        # tree oid -> [(mode, name, oid)]
+        self.trees = {}
+        # blob oid -> FileSummary
+        self.summaries = {}
+        self.revisions = set()
+        self.parsed = 0
+        self.reused = 0
+
+    def close(self):
+        # Pool workers forked after Popen inherit the stdin pipe, so closing
+        # our end alone does not always deliver EOF to cat-file.
+        self.process.stdin.close()
+        self.process.terminate()
+        self.process.wait()
+
+    def read(self, name):
+        self.process.stdin.write(name.encode() + b"\n")
+        self.process.stdin.flush()
+        # "<oid> <type> <size>", or "<name> missing" where the name may
+        # itself contain spaces, so only a numeric size marks a found object.
+        oid, _, rest = self.process.stdout.readline().rstrip(b"\n").partition(b" ")
+        kind, _, size = rest.partition(b" ")
+        if not size.isdigit():
+            raise LookupError(f"{name} is not a git object")
+        data = self.process.stdout.read(int(size))
+        self.process.stdout.read(1)
+        return oid.decode(), kind.decode(), data
+
+    def tree_entries(self, oid, data=None):
+        entries = self.trees.get(oid)
+        if entries is not None:
+            return entries
+        if data is None:
+            data = self.read(oid)[2]
+        # "<mode> <name>\0<raw oid>", the oid width follows the hash algorithm.
+        width = len(oid) // 2
+        entries = []
+        pos = 0
+        while pos < len(data):
+            space = data.index(b" ", pos)
+            nul = data.index(b"\0", space)
+            entries.append(
+                (
+                    data[pos:space].decode(),
+                    data[space + 1 : nul].decode(errors="surrogateescape"),
+                    data[nul + 1 : nul + 1 + width].hex(),
+                )
+            )
+            pos = nul + 1 + width
+        entries.sort(key=lambda entry: entry[1])
+        self.trees[oid] = entries
+        return entries
+
+    def verify_revision(self, rev):
+        if rev in self.revisions:
+            return
+        result = subprocess.run(
+            [
+                "git",
+                "-C",
+                self.toplevel,
+                "rev-parse",
+                "--verify",
+                "--quiet",
+                "--end-of-options",
+                f"{rev}^{{commit}}",
+            ],
+            capture_output=True,
+        )
+        if result.returncode != 0:
+            raise LookupError(f"{rev} is not a valid revision")
+        self.revisions.add(rev)
+
+    def relative_path(self, path):
+        path = os.path.relpath(os.path.abspath(path), self.toplevel)
+        return "" if path == "." else path.replace(os.sep, "/")
+
+    def list_python_files(self, rev, path):
+        prefix = self.relative_path(path)
+        try:
+            oid, kind, data = self.read(f"{rev}:{prefix}")
+        except LookupError:
+            raise LookupError(f"{prefix or '.'} does not exist at revision {rev}")
+        if kind == "blob":
+            return [(prefix, oid)] if prefix.endswith(".py") else []
+        if kind != "tree":
+            return []
+
+        files = []
+
+        def _walk(tree_oid, tree_prefix, depth, data=None):
+            subdirs = []
+            for mode, name, entry_oid in self.tree_entries(tree_oid, data):
+                entry_path = f"{tree_prefix}/{name}" if tree_prefix else name
+                if mode == "40000":
+                    if self.recursive and not any(
+                        fnmatch.fnmatch(name, pat) for pat in self.skip_dirs
+                    ):
+                        subdirs.append((entry_oid, entry_path))
+                elif name.endswith(".py") and mode in ("100644", "100755"):
+                    files.append((entry_path, entry_oid))
+            if self.max_depth is not None and depth >= self.max_depth:
+                return
+            for subdir_oid, subdir_path in subdirs:
+                _walk(subdir_oid, subdir_path, depth + 1)
+
+        _walk(oid, prefix, 0, data)
+        return files
+
+    def snapshot(self, rev, paths):
+        self.verify_revision(rev)
+        files = {}
+        for path in paths:
+            files.update(self.list_python_files(rev, path))
+
+        # Paths sharing one blob are parsed once, under the first path.
+        paths_by_oid = {}
+        for path, oid in files.items():
+            paths_by_oid.setdefault(oid, path)
+        missing = [oid for oid in paths_by_oid if oid not in self.summaries]
+        self.reused += len(paths_by_oid) - len(missing)
+        items = [
+            (os.path.join(self.toplevel, paths_by_oid[oid]), self.read(oid)[2])
+            for oid in missing
+        ]
+        worker = partial(process_blob, passes=self.passes)
+        for oid, summary in zip(missing, parallel_map(worker, items, self.executor)):
+            self.summaries[oid] = summary
+            self.parsed += 1
+
+        return {
+            path: (
+                oid,
+                replace(
+                    self.summaries[oid], file_path=os.path.join(self.toplevel, path)
+                ),
+            )
+            for path, oid in sorted(files.items())
+        }
+
+    def history(self, old_rev, new_rev):
+        self.verify_revision(old_rev)
+        self.verify_revision(new_rev)
+        log = subprocess.run(
+            [
+                "git",
+                "-C",
+                self.toplevel,
+                "log",
+                "--reverse",
+                "--first-parent",
+                "--format=%H%x00%s",
+                f"{old_rev}..{new_rev}",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        return [tuple(line.split("\0", 1)) for line in log.splitlines()]
+
+
+def signatures(summary):
+    result = {}
+    for cls in summary.class_details:
+        bases = f"({', '.join(cls.bases)})" if cls.bases else ""
+        result[cls.name] = (cls.lineno, f"class {cls.name}{bases}")
+        for func in cls.functions:
+            name = f"{cls.name}.{func.name}"
+            result[name] = (
+                func.lineno,
+                f"{name}({format_args(func.args)}) -> {func.return_type or 'None'}",
+            )
+    for func in summary.function_details:
+        result[func.name] = (
+            func.lineno,
+            f"{func.name}({format_args(func.args)}) -> {func.return_type or 'None'}",
+        )
+    return result
+
+
+def diff_snapshots(old, new):
+    changes = []
+    for path in sorted(old.keys() | new.keys()):
+        old_oid, old_summary = old.get(path, (None, None))
+        new_oid, new_summary = new.get(path, (None, None))
+        if old_oid == new_oid:
+            continue
+        for summary in (old_summary, new_summary):
+            if summary is not None and summary.error is not None:
+                print(
+                    Messages.error_processing.format(
+                        file_path=path, error=summary.error
+                    ),
+                    file=sys.stderr,
+                )
+        if any(
+            s is not None and s.error is not None for s in (old_summary, new_summary)
+        ):
+            continue
+        old_signatures = signatures(old_summary) if old_summary else {}
+        new_signatures = signatures(new_summary) if new_summary else {}
+        file_changes = []
+        for name, (lineno, signature) in new_signatures.items():
+            previous = old_signatures.get(name)
+            if previous is None:
+                file_changes.append((lineno, "added", path, name, None, signature))
+            elif previous[1] != signature:
+                file_changes.append(
+                    (lineno, "changed", path, name, previous[1], signature)
+                )
+        for name, (lineno, signature) in old_signatures.items():
+            if name not in new_signatures:
+                file_changes.append((lineno, "removed", path, name, signature, None))
+        changes += sorted(file_changes)
+    return changes
+
+
+def report_signature_changes(changes, writer=None, rev=None):
+    for lineno, change, path, name, old, new in changes:
+        if writer is not None:
+            writer.write(
+                {
+                    "type": "signature",
+                    "change": change,
+                    "rev": rev,
+                    "path": path,
+                    "name": name,
+                    "lineno": lineno,
+                    "old": old,
+                    "new": new,
+                }
+            )
+        elif change == "added":
+            print(
+                colored(
+                    Messages.signature_added.format(
+                        path=path, lineno=lineno, signature=new
+                    ),
+                    "green",
+                )
+            )
+        elif change == "removed":
+            print(
+                colored(
+                    Messages.signature_removed.format(
+                        path=path, lineno=lineno, signature=old
+                    ),
+                    "red",
+                )
+            )
+        else:
+            print(
+                colored(
+                    Messages.signature_changed.format(
+                        path=path, lineno=lineno, old=old, new=new
+                    ),
+                    "yellow",
+                )
+            )
+
+
+def run_revisions(
+    args, executor=None, passes=(), collectors=(), writer=None, shown_passes=None
+):
+    try:
+        scanner = GitRevisionScanner(
+            args.paths[0],
+            executor,
+            args.recursive,
+            args.max_depth,
+            args.skip_dirs,
+            passes,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(Messages.error_git.format(error=getattr(e, "stderr", None) or e))
+        sys.exit(1)
+
+    try:
+        if args.rev:
+            total_files = 0
+            total_lines = 0
+            total_functions = 0
+            total_classes = 0
+            for _, summary in scanner.snapshot(args.rev, args.paths).values():
+                lines, functions, classes = report_file(
+                    summary,
+                    args.sorted,
+                    args.sorted_desc,
+                    args.header_only,
+                    args.show_imports,
+                    args.line_links,
+                    args.summary_only,
+                    writer,
+                    shown_passes,
+                )
+                for collector in collectors:
+                    collector.add(summary)
+                total_files += 1
+                total_lines += lines
+                total_functions += functions
+                total_classes += classes
+            report_summary(
+                total_files,
+                total_lines,
+                total_functions,
+                total_classes,
+                writer=writer,
+            )
+            return
+
+        old_rev, _, new_rev = args.diff_revs.partition("..")
+        if not old_rev or not new_rev or new_rev.startswith("."):
+            print(Messages.error_git.format(error="--diff_revs expects A..B"))
+            sys.exit(1)
+        if args.history:
+            steps = scanner.history(old_rev, new_rev)
+        else:
+            steps = [(new_rev, None)]
+
+        counts = {"added": 0, "removed": 0, "changed": 0}
+        previous = scanner.snapshot(old_rev, args.paths)
+        for rev, subject in steps:
+            current = scanner.snapshot(rev, args.paths)
+            changes = diff_snapshots(previous, current)
+            if args.history and changes:
+                if writer is not None:
+                    writer.write({"type": "revision", "rev": rev, "subject": subject})
+                else:
+                    print(
+                        Messages.revision_header.format(rev=rev[:12], subject=subject)
+                    )
+            report_signature_changes(changes, writer, rev)
+            for change in changes:
+                counts[change[1]] += 1
+            previous = current
+
+        if writer is not None:
+            writer.write(
+                {
+                    "type": "diff_summary",
+                    **counts,
+                    "parsed": scanner.parsed,
+                    "reused": scanner.reused,
+                }
+            )
+        else:
+            print(
+                Messages.diff_summary.format(
+                    **counts, parsed=scanner.parsed, reused=scanner.reused
+                )
+            )
+    except (LookupError, subprocess.CalledProcessError) as e:
+        print(Messages.error_git.format(error=getattr(e, "stderr", None) or e))
+        sys.exit(1)
+    finally:
+        scanner.close()
 
 
-def list_classes_and_functions(script_path, *args, **kwargs):
-    with open(script_path, "r") as file:
-        tree = ast.parse(file.read(), filename=script_path)
+def add_scan_arguments(parser):
+    parser.add_argument(
+        "-r",
+        "--recursive",
+        action="store_true",
+        help="Descend into subdirectories of the given directories.",
+    )
+    parser.add_argument(
+        "--max_depth",
+        type=int,
+        default=None,
+        help="Maximum directory depth for --recursive (0 = given directory only).",
+    )
+    parser.add_argument(
+        "--skip_dirs",
+        nargs="*",
+        default=list(DEFAULT_SKIP_DIRS),
+        help="Glob patterns of directory names not to descend into (replaces the defaults).",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes used for parsing (1 = no process pool).",
+    )
 
-    class_details = []
-    function_details = []
-    import_details = []
 
-    class FunctionVisitor(ast.NodeVisitor):
-        def visit_Import(self, node):
-            import_details.append((node.lineno, ast.unparse(node)))
-            self.generic_visit(node)
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS symbols (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    class_name TEXT,
+    lineno INTEGER NOT NULL,
+    args TEXT NOT NULL,
+    return_type TEXT
+);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols(name);
+CREATE INDEX IF NOT EXISTS symbols_file ON symbols(file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS symbols_fts USING fts5(
+    name, class_name, args, return_type,
+    content='symbols', content_rowid='id', prefix='2 3 4'
+);
+CREATE TRIGGER IF NOT EXISTS symbols_ai AFTER INSERT ON symbols BEGIN
+    INSERT INTO symbols_fts(rowid, name, class_name, args, return_type)
+    VALUES (new.id, new.name, new.class_name, new.args, new.return_type);
+END;
+CREATE TRIGGER IF NOT EXISTS symbols_ad AFTER DELETE ON symbols BEGIN
+    INSERT INTO symbols_fts(symbols_fts, rowid, name, class_name, args, return_type)
+    VALUES ('delete', old.id, old.name, old.class_name, old.args, old.return_type);
+END;
+"""
 
-        def visit_ImportFrom(self, node):
-            import_details.append((node.lineno, ast.unparse(node)))
-            self.generic_visit(node)
 
-        def visit_FunctionDef(self, node):
-            if isinstance(node.parent, ast.ClassDef):
-                class_details[-1]["functions"].append(
-                    (node.name, node.lineno, node.args.args, node.returns)
-                )
-            else:
-                function_details.append(
-                    (node.name, node.lineno, node.args.args, node.returns)
+def default_index_path():
+    return os.path.join(default_cache_dir(), "ast_index.sqlite")
+
+
+def open_index(db_path):
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    connection = sqlite3.connect(db_path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+    connection.executescript(INDEX_SCHEMA)
+    return connection
+
+
+def format_args(args):
+    return ", ".join(
+        f"{arg}: {annotation}" if annotation and arg != "self" else arg
+        for arg, annotation in args
+        if not (arg == "self" and not annotation)
+    )
+
+
+def symbol_rows(file_id, summary):
+    for cls in summary.class_details:
+        yield file_id, "class", cls.name, None, cls.lineno, ", ".join(cls.bases), None
+        for func in cls.functions:
+            yield (
+                file_id,
+                "method",
+                func.name,
+                cls.name,
+                func.lineno,
+                format_args(func.args),
+                func.return_type,
+            )
+    for func in summary.function_details:
+        yield (
+            file_id,
+            "function",
+            func.name,
+            None,
+            func.lineno,
+            format_args(func.args),
+            func.return_type,
+        )
+
+
+def update_index(connection, roots, file_paths, executor=None):
+    known = {}
+    for root in roots:
+        root = os.path.abspath(root)
+        prefix = root.rstrip(os.sep) + os.sep
+        # Range scan on the unique path index; everything below root sorts
+        # between "root/" and "root0" ("0" follows "/" in ASCII).
+        rows = connection.execute(
+            "SELECT path, id, mtime_ns, size FROM files"
+            " WHERE path = ? OR (path >= ? AND path < ?)",
+            (root, prefix, prefix[:-1] + chr(ord(os.sep) + 1)),
+        )
+        for path, file_id, mtime_ns, size in rows:
+            known[path] = (file_id, mtime_ns, size)
+
+    changed = []
+    stats = {}
+    for file_path in file_paths:
+        path = os.path.abspath(file_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entry = known.pop(path, None)
+        if entry is None or entry[1:] != (stat.st_mtime_ns, stat.st_size):
+            changed.append(path)
+            stats[path] = stat
+
+    with connection:
+        # Whatever is still in `known` was deleted or is no longer scanned.
+        connection.executemany(
+            "DELETE FROM files WHERE id = ?", [(entry[0],) for entry in known.values()]
+        )
+        for summary in scan_files(changed, executor):
+            if summary.error is not None:
+                print(
+                    Messages.error_processing.format(
+                        file_path=summary.file_path, error=summary.error
+                    ),
+                    file=sys.stderr,
                 )
-            self.generic_visit(node)
+                continue
+            stat = stats[summary.file_path]
+            connection.execute("DELETE FROM files WHERE path = ?", (summary.file_path,))
+            file_id = connection.execute(
+                "INSERT INTO files (path, mtime_ns, size) VALUES (?, ?, ?)",
+                (summary.file_path, stat.st_mtime_ns, stat.st_size),
+            ).lastrowid
+            connection.executemany(
+                "INSERT INTO symbols"
+                " (file_id, kind, name, class_name, lineno, args, return_type)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                symbol_rows(file_id, summary),
+            )
 
-        def visit_ClassDef(self, node):
-            bases = [ast.unparse(base) for base in node.bases]
-            class_details.append(
-                {
-                    "name": node.name,
-                    "lineno": node.lineno,
-                    "bases": bases,
-                    "functions": [],
-                }
+    return len(changed), len(known)
+
+
+def query_index(connection, term, kind=None, exact=False, limit=50, all_columns=False):
+    sql = (
+        "SELECT symbols.kind, symbols.name, symbols.class_name, symbols.args,"
+        " symbols.return_type, files.path, symbols.lineno"
+        " FROM symbols JOIN files ON files.id = symbols.file_id"
+    )
+    if exact:
+        sql += " WHERE symbols.name = ?"
+        params = [term]
+    else:
+        # The tokenizer keeps only letters and digits, so `_` alone would
+        # silently match nothing.
+        if not re.search(r"[^\W_]", term):
+            raise ValueError(
+                f"{term!r} has no letters or digits to search for; use --exact"
             )
-            self.generic_visit(node)
+        # Prefix phrase query, so `list_cl` finds `list_classes_and_functions`.
+        # Only names match unless argument, class and return type names are
+        # asked for too.
+        sql += (
+            " WHERE symbols.id IN"
+            " (SELECT rowid FROM symbols_fts WHERE symbols_fts MATCH ?)"
+        )
+        phrase = '"' + term.replace('"', '""') + '"*'
+        params = [phrase if all_columns else "{name} : " + phrase]
+    if kind is not None:
+        sql += " AND symbols.kind = ?"
+        params.append(kind)
+    # Exact names first, then names starting with the term, then the rest.
+    sql += (
+        " ORDER BY symbols.name = ? DESC, lower(substr(symbols.name, 1, ?)) = ? DESC,"
+        " length(symbols.name), files.path, symbols.lineno"
+    )
+    sql += " LIMIT ?"
+    params += [term, len(term), term.lower(), limit]
+    return connection.execute(sql, params).fetchall()
 
-    def add_parent_info(node):
-        for child in ast.iter_child_nodes(node):
-            child.parent = node
-            add_parent_info(child)
 
-    add_parent_info(tree)
+def index_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="ast_explorer.py index",
+        description="Store the classes and functions of Python files in a searchable index.",
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        default=["."],
+        help="List of files or directories to index.",
+    )
+    parser.add_argument(
+        "--db",
+        default=default_index_path(),
+        help="Location of the index (default: $DS_AST_CACHE_DIR or ~/.cache/ds_util).",
+    )
+    add_scan_arguments(parser)
+    args = parser.parse_args(argv)
 
-    visitor = FunctionVisitor()
-    visitor.visit(tree)
+    file_paths = []
+    for path in args.paths:
+        if os.path.isfile(path) and path.endswith(".py"):
+            file_paths.append(path)
+        elif os.path.isdir(path):
+            file_paths += find_python_files(
+                path, args.recursive, args.max_depth, args.skip_dirs
+            )
+        else:
+            print(f"Skipping non-Python file: {path}")
 
-    return class_details, function_details, import_details
+    connection = open_index(args.db)
+    executor = ProcessPoolExecutor(args.workers) if args.workers > 1 else None
+    try:
+        updated, removed = update_index(connection, args.paths, file_paths, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        connection.close()
+    print(
+        Messages.index_stats.format(
+            files=len(file_paths), updated=updated, removed=removed, db=args.db
+        )
+    )
 
 
-def process_file(
-    file_path,
-    sort_items,
-    sort_desc,
-    header_only,
-    show_imports,
-    line_links,
-    summary_only,
-    *args,
-    **kwargs,
-):
+def query_main(argv):
+    parser = argparse.ArgumentParser(
+        prog="ast_explorer.py query",
+        description="Look up classes and functions in the index built by `index`.",
+    )
+    parser.add_argument("term", help="Name or name prefix to look up.")
+    parser.add_argument(
+        "--db",
+        default=default_index_path(),
+        help="Location of the index (default: $DS_AST_CACHE_DIR or ~/.cache/ds_util).",
+    )
+    parser.add_argument(
+        "--kind",
+        choices=("class", "method", "function"),
+        help="Only return symbols of this kind.",
+    )
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="Match the name exactly instead of by full-text prefix.",
+    )
+    parser.add_argument(
+        "--all_columns",
+        action="store_true",
+        help="Also match argument names, the class name of methods and return types.",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=50, help="Maximum number of results."
+    )
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"Error: No index at {args.db}, run `ast_explorer.py index` first.")
+        sys.exit(1)
+
+    connection = open_index(args.db)
     try:
-        with open(file_path, "r") as file:
-            lines = file.readlines()
+        rows = query_index(
+            connection,
+            args.term,
+            args.kind,
+            args.exact,
+            args.limit,
+            args.all_columns,
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    finally:
+        connection.close()
 
-        class_details, function_details, import_details = list_classes_and_functions(
-            file_path
+    for kind, name, class_name, sig_args, return_type, path, lineno in rows:
+        if kind == "class":
+            symbol = colored(name, Colors.classname) + (
+                f"({sig_args})" if sig_args else ""
+            )
+        else:
+            symbol = (
+                (f"{colored(class_name, Colors.classname)}." if class_name else "")
+                + colored(name, Colors.functionname)
+                + f"({sig_args}) -> {return_type or 'None'}"
+            )
+        print(
+            Messages.query_result.format(
+                kind=kind, symbol=symbol, link=vscode_link(path, lineno)
+            )
         )
 
-        if sort_items or sort_desc:
-            reverse = sort_desc
-            class_details.sort(key=lambda x: x["name"], reverse=reverse)
-            for cls in class_details:
-                cls["functions"].sort(key=lambda x: x[0], reverse=reverse)
-            function_details.sort(key=lambda x: x[0], reverse=reverse)
-            import_details.sort(key=lambda x: x[0], reverse=reverse)
 
-        if not summary_only:
-            print(
-                Messages.filepath_details.format(
-                    file_path=colored(os.path.abspath(file_path), Colors.filepath),
-                    lines=len(lines),
-                    functions=len(function_details)
-                    + sum(len(cls["functions"]) for cls in class_details),
-                    classes=len(class_details),
-                )
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+) | IN_DELETE_SELF
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def default_socket_path():
+    return os.path.join(default_cache_dir(), "ast_explorer.sock")
+
+
+class InotifyWatcher:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not supported on this platform")
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        # wd -> (directory, depth below its scanned root)
+        self.watches = {}
+
+    def fileno(self):
+        return self.fd
+
+    def add_directory(self, directory, depth):
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(directory), ctypes.c_uint32(WATCH_MASK)
+        )
+        if wd >= 0:
+            self.watches[wd] = (directory, depth)
+
+    def read_events(self):
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                directory, depth = self.watches.get(wd, (None, 0))
+                events.append((mask, directory, depth, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Text output of a daemon request; reports the client's terminal so termcolor
+# makes the same colour decision it would have made in the client.
+class CapturedOutput(io.StringIO):
+    def __init__(self, tty):
+        super().__init__()
+        self.tty = tty
+
+    def isatty(self):
+        return self.tty
+
+
+# Keeps every FileSummary of the watched roots in memory. It implements the
+# ParseCache lookup/store interface, so requests run through the normal run()
+# path with the daemon standing in for the on-disk cache.
+class WatchDaemon:
+    def __init__(self, roots, recursive, max_depth, skip_dirs, executor, seed=None):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.recursive = recursive
+        self.max_depth = max_depth
+        self.skip_dirs = skip_dirs
+        self.executor = executor
+        self.seed = seed
+        self.use_hash = False
+        self.hits = 0
+        self.misses = 0
+        # path -> (mtime_ns, size, summary)
+        self.entries = {}
+        self.watcher = None
+
+    def lookup(self, file_path, stat, counts_only=False, passes=()):
+        entry = self.entries.get(os.path.abspath(file_path))
+        if entry is not None:
+            mtime_ns, size, summary = entry
+            if (
+                mtime_ns == stat.st_mtime_ns
+                and size == stat.st_size
+                and summary.satisfies(counts_only, passes)
+            ):
+                self.hits += 1
+                return replace(summary.with_metrics(passes), file_path=file_path)
+        if self.seed is not None:
+            summary = self.seed.lookup(file_path, stat, counts_only, passes)
+            if summary is not None:
+                self.store(stat, summary)
+                return summary
+        self.misses += 1
+        return None
+
+    def store(self, stat, summary):
+        if summary.error is None:
+            self.entries[os.path.abspath(summary.file_path)] = (
+                stat.st_mtime_ns,
+                stat.st_size,
+                summary,
             )
 
-            if show_imports:
-                for lineno, import_stmt in import_details:
-                    print(f"{lineno:6} {import_stmt}")
+    def discover(self):
+        file_paths = []
+        for root in self.roots:
+            if os.path.isfile(root) and root.endswith(".py"):
+                file_paths.append(root)
+            elif os.path.isdir(root):
+                file_paths += find_python_files(
+                    root, self.recursive, self.max_depth, self.skip_dirs
+                )
+        return file_paths
 
-            if not header_only:
-                for cls in class_details:
-                    base_classes = (
-                        f"({', '.join(cls['bases'])})" if cls["bases"] else ""
-                    )
-                    class_name = (
-                        f"{colored(cls['name'], Colors.classname)}{base_classes}"
-                    )
-                    print(
-                        Messages.class_header.format(
-                            lineno=cls["lineno"], class_name=class_name
-                        )
+    def refresh(self, file_paths=None):
+        if file_paths is None:
+            file_paths = self.discover()
+            alive = set(file_paths)
+            for path in [path for path in self.entries if path not in alive]:
+                del self.entries[path]
+        for _ in scan_files(file_paths, self.executor, self):
+            pass
+
+    def forget(self, prefix):
+        for path in [path for path in self.entries if path.startswith(prefix)]:
+            del self.entries[path]
+
+    def watch_tree(self, directory, depth):
+        self.watcher.add_directory(directory, depth)
+        if not self.recursive or (
+            self.max_depth is not None and depth >= self.max_depth
+        ):
+            return
+        try:
+            with os.scandir(directory) as it:
+                subdirs = [
+                    entry.path
+                    for entry in it
+                    if entry.is_dir(follow_symlinks=False)
+                    and not any(
+                        fnmatch.fnmatch(entry.name, pat) for pat in self.skip_dirs
                     )
-                    for func in cls["functions"]:
-                        args_with_hints = ", ".join(
-                            f"{colored(arg.arg, Colors.argname)}{': ' + ast.unparse(arg.annotation) if arg.annotation and arg.arg != 'self' else ''}"
-                            for arg in func[2]
-                            if not (arg.arg == "self" and not arg.annotation)
-                        )
-                        return_type = ast.unparse(func[3]) if func[3] else "None"
-                        function_name = f"{colored(func[0], Colors.functionname)}"
-                        link = (
-                            f" (vscode://file/{os.path.abspath(file_path)}:{func[1]})"
-                            if line_links
-                            else ""
-                        )
-                        print(
-                            Messages.function_detail.format(
-                                lineno=func[1],
-                                function_name=function_name,
-                                args_with_hints=args_with_hints,
-                                return_type=return_type,
-                                link=link,
+                ]
+        except OSError:
+            return
+        for subdir in subdirs:
+            self.watch_tree(subdir, depth + 1)
+
+    def start_watcher(self, poll_interval):
+        try:
+            self.watcher = InotifyWatcher()
+        except OSError as e:
+            print(
+                Messages.watch_fallback.format(error=e, interval=poll_interval),
+                file=sys.stderr,
+            )
+            return
+        # Directories watched only for single-file roots get depth -1, so other
+        # files next to them are ignored. Directory roots are added afterwards
+        # and take over the watch if both apply.
+        for root in self.roots:
+            if os.path.isfile(root):
+                self.watcher.add_directory(os.path.dirname(root), -1)
+        for root in self.roots:
+            if os.path.isdir(root):
+                self.watch_tree(root, 0)
+
+    def handle_events(self):
+        changed = set()
+        for mask, directory, depth, name in self.watcher.read_events():
+            if mask & IN_Q_OVERFLOW:
+                self.refresh()
+                return
+            if directory is None:
+                continue
+            path = os.path.join(directory, name)
+            removed = mask & (IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF)
+            if mask & IN_ISDIR:
+                if removed:
+                    self.forget(path + os.sep)
+                elif (
+                    self.recursive
+                    and depth >= 0
+                    and (self.max_depth is None or depth < self.max_depth)
+                ):
+                    if not any(fnmatch.fnmatch(name, pat) for pat in self.skip_dirs):
+                        self.watch_tree(path, depth + 1)
+                        changed.update(
+                            find_python_files(
+                                path,
+                                self.recursive,
+                                (
+                                    None
+                                    if self.max_depth is None
+                                    else self.max_depth - depth - 1
+                                ),
+                                self.skip_dirs,
                             )
                         )
+            elif name.endswith(".py"):
+                if removed:
+                    self.entries.pop(path, None)
+                    changed.discard(path)
+                elif depth >= 0 or path in self.roots:
+                    changed.add(path)
+        if changed:
+            self.refresh(sorted(path for path in changed if os.path.isfile(path)))
 
-                for func in function_details:
-                    args_with_hints = ", ".join(
-                        f"{colored(arg.arg, Colors.argname)}: {ast.unparse(arg.annotation) if arg.annotation and arg.arg != 'self' else ''}"
-                        for arg in func[2]
-                        if not (arg.arg == "self" and not arg.annotation)
-                    )
-                    return_type = ast.unparse(func[3]) if func[3] else "None"
-                    function_name = f"{colored(func[0], Colors.functionname)}"
-                    link = (
-                        f" (vscode://file/{os.path.abspath(file_path)}:{func[1]})"
-                        if line_links
-                        else ""
-                    )
-                    print(
-                        Messages.standalone_function.format(
-                            lineno=func[1],
-                            function_name=function_name,
-                            args_with_hints=args_with_hints,
-                            return_type=return_type,
-                            link=link,
-                        )
-                    )
+    def handle_request(self, connection):
+        connection.settimeout(WATCH_REQUEST_TIMEOUT)
+        chunks = []
+        while True:
+            chunk = connection.recv(1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        request = json.loads(b"".join(chunks))
 
-        return (
-            len(lines),
-            len(function_details) + sum(len(cls["functions"]) for cls in class_details),
-            len(class_details),
-        )
+        stdout = CapturedOutput(request.get("tty", False))
+        stderr = io.StringIO()
+        records = io.BytesIO()
+        status = 0
+        cwd = os.getcwd()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                os.chdir(request["cwd"])
+                args = build_parser().parse_args(request["argv"])
+                # Parsing misses in-process keeps relative paths meaningful.
+                run(args, None, self, records)
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else int(e.code is not None)
+            except Exception as e:
+                print(Messages.error_processing.format(file_path=cwd, error=e))
+                status = 1
+            finally:
+                os.chdir(cwd)
+        response = {
+            "stdout": stdout.getvalue() + records.getvalue().decode(),
+            "stderr": stderr.getvalue(),
+            "status": status,
+        }
+        connection.sendall(json.dumps(response).encode())
 
-    except Exception as e:
-        print(
-            Messages.error_processing.format(file_path=file_path, error=e),
-            file=sys.stderr,
-        )
-        return 0, 0, 0
+    def serve_forever(self, socket_path, poll_interval):
+        self.start_watcher(poll_interval)
+        self.refresh()
+        if self.seed is not None:
+            self.seed.save()
+            self.seed = None
 
+        os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # SIGTERM unwinds like Ctrl-C, so the socket file is removed either way.
+        # KeyboardInterrupt, since a request's run() swallows SystemExit.
+        previous_handler = signal.signal(signal.SIGTERM, raise_interrupt)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        selector = selectors.DefaultSelector()
+        try:
+            # Created 0600 rather than chmod-ed after bind, which would leave
+            # it open to other users for a moment.
+            umask = os.umask(0o177)
+            try:
+                server.bind(socket_path)
+            finally:
+                os.umask(umask)
+            server.listen()
 
-def process_directory(
-    directory,
-    sort_items,
-    sort_desc,
-    header_only,
-    show_imports,
-    line_links,
-    summary_only,
-    *args,
-    **kwargs,
-):
-    total_files = 0
-    total_lines = 0
-    total_functions = 0
-    total_classes = 0
+            selector.register(server, selectors.EVENT_READ, "request")
+            if self.watcher is not None:
+                selector.register(self.watcher, selectors.EVENT_READ, "inotify")
+            print(
+                Messages.watch_ready.format(
+                    files=len(self.entries),
+                    watcher="inotify" if self.watcher is not None else "polling",
+                    socket_path=socket_path,
+                ),
+                file=sys.stderr,
+            )
 
-    for file in os.listdir(directory):
-        file_path = os.path.join(directory, file)
-        if os.path.isfile(file_path) and file.endswith(".py"):
-            lines, functions, classes = process_file(
-                file_path,
-                sort_items,
-                sort_desc,
-                header_only,
-                show_imports,
-                line_links,
-                summary_only,
-            )
-            total_files += 1
-            total_lines += lines
-            total_functions += functions
-            total_classes += classes
+            while True:
+                timeout = None if self.watcher is not None else poll_interval
+                ready = selector.select(timeout)
+                if not ready:
+                    self.refresh()
+                for key, _ in ready:
+                    if key.data == "inotify":
+                        self.handle_events()
+                        continue
+                    connection, _ = server.accept()
+                    with connection:
+                        try:
+                            self.handle_request(connection)
+                        except (OSError, ValueError):
+                            pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
+            selector.close()
+            server.close()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            if self.watcher is not None:
+                self.watcher.close()
 
-    if not summary_only:
-        print(
-            Messages.summary.format(
-                total_files=total_files,
-                total_lines=total_lines,
-                total_functions=total_functions,
-                total_classes=total_classes,
-            )
+
+def raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def query_daemon(socket_path, argv):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(
+            json.dumps(
+                {"argv": argv, "cwd": os.getcwd(), "tty": sys.stdout.isatty()}
+            ).encode()
         )
+        client.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = client.recv(1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    response = json.loads(b"".join(chunks))
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    return response["status"]
 
 
-def main(*args, **kwargs):
+def build_parser():
     parser = argparse.ArgumentParser(
         description="Process some Python files or directories."
     )
@@ -251,7 +3236,7 @@ def main(*args, **kwargs):
         "paths",
         nargs="*",
         default=["."],
-        help="List of files or directories to process.",
+        help="List of files, directories or archives (.whl, .zip, .egg, .tar.gz, ...) to process.",
     )
     parser.add_argument(
         "--sorted",
@@ -266,7 +3251,7 @@ def main(*args, **kwargs):
     parser.add_argument(
         "--header_only",
         action="store_true",
-        help="Display only the header of the analysis, suppressing function details.",
+        help="Display only the header of the analysis, suppressing function details. Without --show_imports or --analyze, definitions are counted without parsing, so files with syntax errors are counted rather than reported.",
     )
     parser.add_argument(
         "--show_imports",
@@ -281,11 +3266,154 @@ def main(*args, **kwargs):
     parser.add_argument(
         "--summary_only",
         action="store_true",
-        help="Only print out folder examined and the summary of total number of lines, files, and classes.",
+        help="Only print out folder examined and the summary of total number of lines, files, and classes. Without --analyze, definitions are counted without parsing, so files with syntax errors are counted rather than reported.",
+    )
+    add_scan_arguments(parser)
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Neither read nor write the on-disk parse cache.",
+    )
+    parser.add_argument(
+        "--rebuild_cache",
+        action="store_true",
+        help="Discard the existing parse cache and re-parse every file.",
+    )
+    parser.add_argument(
+        "--cache_hash",
+        action="store_true",
+        help="Compare content hashes when mtime changed but size did not.",
+    )
+    parser.add_argument(
+        "--cache_path",
+        default=default_cache_path(),
+        help="Location of the parse cache (default: $DS_AST_CACHE_DIR or ~/.cache/ds_util).",
+    )
+    parser.add_argument(
+        "--format",
+        choices=("text", "ndjson", "json"),
+        default="text",
+        help="Output format; ndjson/json emit one uncoloured record per file, class and function.",
+    )
+    parser.add_argument(
+        "--graph",
+        nargs="?",
+        const="text",
+        choices=("text", "dot", "json"),
+        help="Build the import graph of the scanned modules and report cycles and fan-in/out, or export it as DOT/JSON.",
+    )
+    parser.add_argument(
+        "--closure",
+        metavar="MODULE",
+        help="With --graph, list every module MODULE imports transitively, with the shortest import chain.",
+    )
+    parser.add_argument(
+        "--graph_top",
+        type=int,
+        default=10,
+        help="Number of modules listed in the --graph fan-in/fan-out rankings.",
+    )
+    parser.add_argument(
+        "--cache_max_entries",
+        type=int,
+        default=DEFAULT_CACHE_MAX_ENTRIES,
+        help="Evict the least recently used cache entries beyond this count.",
+    )
+
+    parser.add_argument(
+        "--rev",
+        help="Scan the paths as they are at this git revision, read from the object store.",
+    )
+    parser.add_argument(
+        "--diff_revs",
+        metavar="A..B",
+        help="List the function and class signatures added, removed or changed between two git revisions.",
+    )
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="With --diff_revs, report the changes of every first-parent commit in A..B.",
+    )
+    parser.add_argument(
+        "--analyze",
+        action="append",
+        choices=["default", *ANALYSIS_PASSES],
+        metavar="PASS",
+        help=f"Compute a per-function metric in the same walk as the listing; repeat for more. 'default' is {' '.join(DEFAULT_PASSES)}. Choices: {', '.join(ANALYSIS_PASSES)}.",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=0,
+        help="Rank the N worst functions across the whole scan.",
+    )
+    parser.add_argument(
+        "--top_by",
+        choices=DEFAULT_PASSES,
+        default="complexity",
+        help="Metric used by --top.",
+    )
+    parser.add_argument(
+        "--duplicates",
+        nargs="?",
+        const="exact",
+        choices=["exact", "abstract"],
+        help="Report clusters of duplicate functions; 'abstract' also matches copies with renamed identifiers and changed constants.",
+    )
+    parser.add_argument(
+        "--duplicates_min_statements",
+        type=int,
+        default=3,
+        help="Ignore functions with fewer statements in --duplicates.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Discover, parse and report files as one bounded pipeline so memory stays flat on huge trees. Tar archive members are reported in archive order rather than sorted.",
+    )
+    parser.add_argument(
+        "--max_in_flight",
+        type=int,
+        default=DEFAULT_MAX_IN_FLIGHT,
+        help="Files held between discovery and output with --stream.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time each phase (read, parse, extract, unparse, cache, output) and print a table to stderr.",
+    )
+    parser.add_argument(
+        "--profile_json",
+        metavar="FILE",
+        help="Write the --profile results as JSON to FILE instead of printing the table.",
+    )
+    parser.add_argument(
+        "--profile_top",
+        type=int,
+        default=10,
+        help="Number of slowest files listed by --profile.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Stay resident, re-parse files as they change and answer queries on --socket.",
+    )
+    parser.add_argument(
+        "--socket",
+        nargs="?",
+        const=default_socket_path(),
+        help="Unix socket of a --watch daemon; queries fall back to a local scan if none is running.",
+    )
+    parser.add_argument(
+        "--poll_interval",
+        type=float,
+        default=1.0,
+        help="Seconds between re-scans for --watch when inotify is unavailable.",
     )
+    return parser
 
-    args = parser.parse_args()
 
+def run(args, executor=None, cache=None, record_stream=None):
     if args.sorted and args.sorted_desc:
         print("Error: Cannot use --sorted and --sorted_desc together.")
         sys.exit(1)
@@ -295,42 +3423,212 @@ def main(*args, **kwargs):
     total_functions = 0
     total_classes = 0
 
-    for path in args.paths:
-        if os.path.isfile(path) and path.endswith(".py"):
-            lines, functions, classes = process_file(
-                path,
-                args.sorted,
-                args.sorted_desc,
-                args.header_only,
-                args.show_imports,
-                args.line_links,
-                args.summary_only,
-            )
-            total_files += 1
-            total_lines += lines
-            total_functions += functions
-            total_classes += classes
-        elif os.path.isdir(path):
-            process_directory(
-                path,
-                args.sorted,
-                args.sorted_desc,
-                args.header_only,
-                args.show_imports,
-                args.line_links,
-                args.summary_only,
+    if args.graph:
+        roots_and_files = []
+        for path in args.paths:
+            if os.path.isfile(path) and path.endswith(".py"):
+                roots_and_files.append(
+                    (package_root(os.path.dirname(os.path.abspath(path))), [path])
+                )
+            elif os.path.isdir(path):
+                roots_and_files.append(
+                    (
+                        package_root(path),
+                        find_python_files(
+                            path, args.recursive, args.max_depth, args.skip_dirs
+                        ),
+                    )
+                )
+        graph = build_import_graph(roots_and_files, executor, cache)
+        if args.closure is not None and args.closure not in graph.index:
+            print(Messages.unknown_module.format(module=args.closure))
+            sys.exit(1)
+        report_import_graph(graph, args.graph, args.graph_top, args.closure)
+        return
+
+    requested = set()
+    for name in args.analyze or ():
+        requested.update(DEFAULT_PASSES if name == "default" else [name])
+    collectors = []
+    if args.top:
+        requested.add(args.top_by)
+    shown_passes = tuple(name for name in ANALYSIS_PASSES if name in requested)
+    if args.top:
+        collectors.append(FunctionRanking(args.top, args.top_by, shown_passes))
+    if args.duplicates:
+        fingerprint = (
+            "fingerprint_abstract" if args.duplicates == "abstract" else "fingerprint"
+        )
+        requested.update((fingerprint, "statements"))
+        collectors.append(DuplicateIndex(fingerprint, args.duplicates_min_statements))
+    passes = tuple(name for name in ANALYSIS_PASSES if name in requested)
+    counts_only = not passes and (
+        args.summary_only or (args.header_only and not args.show_imports)
+    )
+    writer = RecordWriter(args.format, record_stream) if args.format != "text" else None
+    if args.rev or args.diff_revs:
+        try:
+            run_revisions(args, executor, passes, collectors, writer, shown_passes)
+            for collector in collectors:
+                collector.report(args.line_links, writer)
+        finally:
+            if writer is not None:
+                writer.close()
+        return
+
+    profiler = Profiler(args.profile_top) if args.profile or args.profile_json else None
+    max_in_flight = args.max_in_flight if args.stream else None
+    try:
+        for path in args.paths:
+            if os.path.isfile(path) and path.endswith(".py"):
+                summary = next(
+                    scan_files([path], executor, cache, counts_only, profiler, passes)
+                )
+                t0 = time.perf_counter()
+                lines, functions, classes = report_file(
+                    summary,
+                    args.sorted,
+                    args.sorted_desc,
+                    args.header_only,
+                    args.show_imports,
+                    args.line_links,
+                    args.summary_only,
+                    writer,
+                    shown_passes,
+                )
+                if profiler is not None:
+                    profiler.record_file(summary, time.perf_counter() - t0)
+                for collector in collectors:
+                    collector.add(summary)
+                total_files += 1
+                total_lines += lines
+                total_functions += functions
+                total_classes += classes
+            elif os.path.isdir(path):
+                files, lines, functions, classes = process_directory(
+                    path,
+                    args.sorted,
+                    args.sorted_desc,
+                    args.header_only,
+                    args.show_imports,
+                    args.line_links,
+                    args.summary_only,
+                    recursive=args.recursive,
+                    max_depth=args.max_depth,
+                    skip_dirs=args.skip_dirs,
+                    executor=executor,
+                    cache=cache,
+                    writer=writer,
+                    profiler=profiler,
+                    passes=passes,
+                    collectors=collectors,
+                    max_in_flight=max_in_flight,
+                    shown_passes=shown_passes,
+                )
+                total_files += files
+                total_lines += lines
+                total_functions += functions
+                total_classes += classes
+            elif os.path.isfile(path) and is_archive(path):
+                files, lines, functions, classes = process_archive(
+                    path,
+                    args.sorted,
+                    args.sorted_desc,
+                    args.header_only,
+                    args.show_imports,
+                    args.line_links,
+                    args.summary_only,
+                    executor=executor,
+                    writer=writer,
+                    profiler=profiler,
+                    passes=passes,
+                    collectors=collectors,
+                    max_in_flight=max_in_flight,
+                    shown_passes=shown_passes,
+                )
+                total_files += files
+                total_lines += lines
+                total_functions += functions
+                total_classes += classes
+            else:
+                print(
+                    f"Skipping non-Python file: {path}",
+                    file=sys.stdout if writer is None else sys.stderr,
+                )
+
+        if args.summary_only:
+            report_summary(
+                total_files,
+                total_lines,
+                total_functions,
+                total_classes,
+                writer=writer,
             )
+        for collector in collectors:
+            collector.report(args.line_links, writer)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if profiler is not None:
+        if args.profile_json:
+            with open(args.profile_json, "w") as f:
+                json.dump(profiler.to_dict(), f, indent=4)
         else:
-            print(f"Skipping non-Python file: {path}")
+            profiler.print_report()
 
-    if args.summary_only:
-        print(
-            Messages.summary.format(
-                total_files=total_files,
-                total_lines=total_lines,
-                total_functions=total_functions,
-                total_classes=total_classes,
+
+def main(*args, **kwargs):
+    if len(sys.argv) > 1 and sys.argv[1] == "index":
+        return index_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "query":
+        return query_main(sys.argv[2:])
+
+    args = build_parser().parse_args()
+
+    if args.socket is not None and not args.watch:
+        try:
+            sys.exit(query_daemon(args.socket, sys.argv[1:]))
+        except (FileNotFoundError, ConnectionRefusedError):
+            pass
+
+    cache = None
+    if not args.no_cache:
+        cache = ParseCache(
+            args.cache_path,
+            use_hash=args.cache_hash,
+            max_entries=args.cache_max_entries,
+            rebuild=args.rebuild_cache,
+        )
+
+    executor = ProcessPoolExecutor(args.workers) if args.workers > 1 else None
+    try:
+        if args.watch:
+            daemon = WatchDaemon(
+                args.paths,
+                args.recursive,
+                args.max_depth,
+                args.skip_dirs,
+                executor,
+                seed=cache,
             )
+            daemon.serve_forever(
+                args.socket or default_socket_path(), args.poll_interval
+            )
+            return
+        run(args, executor, cache)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if cache is not None:
+            cache.save()
+
+    if cache is not None:
+        print(
+            Messages.cache_stats.format(
+                hits=cache.hits, misses=cache.misses, entries=cache.entry_count()
+            ),
+            file=sys.stderr,
         )
 
 
@@ -1,58 +1,644 @@
 #!/usr/bin/env python3
 
 import argparse
+import codecs
+import errno
+import hashlib
+import json
+import mmap
+import shutil
 import sys
+import tempfile
+import threading
+from collections import deque
 from pathlib import Path
 import os
 import glob
+import gzip
+import lzma
 import fnmatch
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
 
+Matcher = Callable[[str], bool]
 
-def find_files_in_dir(base_path: Path, max_level: int) -> list[Path]:
+SNIFF_BYTES = 8000
+COPY_BUFFER_BYTES = 1 << 20
+DEFAULT_READ_AHEAD_BYTES = 64 << 20
+SNAPSHOT_VERSION = 1
+# Files prefetched per read-ahead worker.
+READ_AHEAD_PER_WORKER = 4
+COMPRESS_BLOCK_BYTES = 1 << 20
+
+
+def compile_patterns(patterns: list[str]) -> Optional[Matcher]:
+    if not patterns:
+        return None
+    # One alternation instead of an fnmatch call per pattern and name.
+    regex = re.compile("|".join(f"(?:{fnmatch.translate(pat)})" for pat in patterns))
+    return lambda name: regex.match(os.path.normcase(name)) is not None
+
+
+def translate_gitignore(pattern: str) -> str:
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            parts.append("/.*")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2 :]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1 : end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append(f"[{body}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(parts)
+
+
+# The .gitignore rules in effect for one directory, parents included.
+class IgnoreRules:
+    def __init__(self, rules: tuple = ()):
+        # (regex, negate, dir_only, base directory)
+        self.rules = rules
+
+    def child(self, directory: str) -> "IgnoreRules":
+        try:
+            with open(os.path.join(directory, ".gitignore")) as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return self
+        rules = []
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            # A slash anywhere but the end anchors the pattern to this directory.
+            anchored = "/" in line
+            body = translate_gitignore(line.lstrip("/"))
+            regex = re.compile(f"{body}$" if anchored else f"(?:.*/)?{body}$")
+            rules.append((regex, negate, dir_only, directory))
+        return IgnoreRules(self.rules + tuple(rules)) if rules else self
+
+    def ignored(self, path: str, is_dir: bool) -> bool:
+        result = False
+        for regex, negate, dir_only, base in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path[len(base) + 1 :]):
+                result = not negate
+        return result
+
+
+def scan_dir(
+    directory: str,
+    matcher: Optional[Matcher],
+    rules: Optional[IgnoreRules],
+) -> tuple[list[str], list[tuple[str, Optional[IgnoreRules]]], list[str]]:
     files = []
+    subdirs = []
+    excluded = []
+    if rules is not None:
+        rules = rules.child(directory)
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue  # skip hidden files like .DS_Store
+                # DirEntry caches the type from readdir, so no extra stat.
+                is_dir = entry.is_dir()
+                if not is_dir and not entry.is_file():
+                    continue
+                if matcher is not None and matcher(entry.name):
+                    excluded.append(entry.path + ("/" if is_dir else ""))
+                    continue
+                if rules is not None and rules.ignored(entry.path, is_dir):
+                    continue
+                if is_dir:
+                    subdirs.append((entry.path, rules))
+                else:
+                    files.append(entry.path)
+    except OSError as e:
+        print(f"# Error listing {directory}: {e}", file=sys.stderr)
+    return files, subdirs, excluded
 
-    def _walk(current_path: Path, current_level: int):
-        if current_level > max_level:
-            return
-        for entry in current_path.iterdir():
-            if entry.name.startswith("."):
-                continue  # skip hidden files like .DS_Store
-            if entry.is_file():
-                files.append(entry)
-            elif entry.is_dir():
-                _walk(entry, current_level + 1)
 
-    _walk(base_path, 0)
-    return files
+# Breadth-first, one level at a time so the directories of a level can be
+# listed in parallel; excluded and ignored directories are never entered.
+def walk_files(
+    base_path: Path,
+    max_level: int,
+    matcher: Optional[Matcher] = None,
+    gitignore: bool = False,
+    executor: Optional[ThreadPoolExecutor] = None,
+) -> tuple[list[Path], list[str]]:
+    files = []
+    excluded = []
+    frontier = [(str(base_path), IgnoreRules() if gitignore else None)]
+    for _ in range(max_level + 1):
+        if not frontier:
+            break
+        results = (
+            executor.map(lambda item: scan_dir(item[0], matcher, item[1]), frontier)
+            if executor is not None and len(frontier) > 1
+            else (scan_dir(directory, matcher, rules) for directory, rules in frontier)
+        )
+        frontier = []
+        for level_files, subdirs, level_excluded in results:
+            files.extend(level_files)
+            frontier.extend(subdirs)
+            excluded.extend(level_excluded)
+    return [Path(f) for f in files], excluded
+
+
+def find_files_in_dir(base_path: Path, max_level: int) -> list[Path]:
+    return walk_files(base_path, max_level)[0]
 
 
-def is_text_file(filepath: Path) -> bool:
+def is_text_chunk(chunk: bytes) -> bool:
     try:
-        with filepath.open("rb") as f:
-            chunk = f.read(8000)
-        chunk.decode("utf-8")
+        # Incremental, so a character cut off at the end of the chunk is fine.
+        codecs.getincrementaldecoder("utf-8")().decode(chunk)
         return True
-    except Exception:
+    except UnicodeDecodeError:
         return False
 
 
-def print_file(filepath: Path, base_dir: Path = None):
-    if not is_text_file(filepath):
-        print(f"# Skipping non-text file: {filepath}", file=sys.stderr)
+def copy_range(src, out, offset: int, end: Optional[int] = None):
+    # Kernel-side copy of src[offset:end] (to EOF by default); falls back to
+    # large buffered writes where sendfile cannot target the output.
+    out.flush()
+    size = os.fstat(src.fileno()).st_size if end is None else end
+    try:
+        while offset < size:
+            sent = os.sendfile(out.fileno(), src.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+        return
+    except (AttributeError, OSError) as e:
+        # io.UnsupportedOperation (no fileno) carries no errno.
+        if (
+            isinstance(e, OSError)
+            and e.errno is not None
+            and e.errno
+            not in (
+                errno.EINVAL,
+                errno.ENOSYS,
+                errno.ENOTSOCK,
+                errno.EOPNOTSUPP,
+            )
+        ):
+            raise
+    src.seek(offset)
+    if end is None:
+        shutil.copyfileobj(src, out, COPY_BUFFER_BYTES)
         return
+    while offset < end and (chunk := src.read(min(COPY_BUFFER_BYTES, end - offset))):
+        out.write(chunk)
+        offset += len(chunk)
 
-    rel_path = filepath.relative_to(base_dir) if base_dir else filepath.name
-    print("###")
-    print(f"# {rel_path}")
-    print("###")
+
+def skip_lines(mm: mmap.mmap, offset: int, count: int) -> int:
+    # Offset just past `count` more newlines, or the end of the mapping.
+    # Whole chunks are skipped by their newline count; only the chunk holding
+    # the target line is walked newline by newline.
+    size = len(mm)
+    while count > 0 and offset < size:
+        chunk_end = min(offset + COPY_BUFFER_BYTES, size)
+        newlines = mm[offset:chunk_end].count(b"\n")
+        if newlines >= count:
+            break
+        count -= newlines
+        offset = chunk_end
+    for _ in range(count):
+        newline = mm.find(b"\n", offset)
+        if newline == -1:
+            return len(mm)
+        offset = newline + 1
+    return offset
+
+
+def tail_offset(mm: mmap.mmap, count: int) -> int:
+    # Start of the last `count` lines, scanning back from the end; a final
+    # newline terminates the last line rather than starting an empty one.
+    end = len(mm)
+    if end and mm[end - 1] == ord("\n"):
+        end -= 1
+    while count > 0 and end > 0:
+        chunk_start = max(end - COPY_BUFFER_BYTES, 0)
+        newlines = mm[chunk_start:end].count(b"\n")
+        if newlines >= count:
+            break
+        count -= newlines
+        end = chunk_start
+    if count > 0 and end == 0:
+        return 0
+    for _ in range(count):
+        end = mm.rfind(b"\n", 0, end)
+        if end == -1:
+            return 0
+    return end + 1
+
+
+def parse_line_range(value: str) -> tuple[int, Optional[int]]:
+    first, sep, last = value.partition(":")
     try:
-        print(filepath.read_text())
-    except Exception as e:
-        print(f"# Error reading {filepath}: {e}", file=sys.stderr)
+        first = int(first) if first else 1
+        last = int(last) if last else None
+    except ValueError:
+        first = 0
+    if not sep or first < 1 or (last is not None and last < first):
+        raise argparse.ArgumentTypeError(
+            f"expected A:B with 1 <= A <= B (either may be omitted), got {value!r}"
+        )
+    return first, last
+
+
+# Per-file limits. Line windows are located through a read-only mapping, so
+# only the lines up to the window (or, for tails, after it) are scanned and
+# only the window itself is copied.
+class ClipWindow:
+    def __init__(
+        self,
+        head: Optional[int] = None,
+        tail: Optional[int] = None,
+        lines: Optional[tuple[int, Optional[int]]] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        self.head = head
+        self.tail = tail
+        self.lines = lines
+        self.max_bytes = max_bytes
+
+    def span(self, fd: int) -> tuple[int, int, Optional[str]]:
+        size = os.fstat(fd).st_size
+        start, end = 0, size
+        shown = []
+        if size and (self.head, self.tail, self.lines) != (None, None, None):
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                if self.lines is not None:
+                    first, last = self.lines
+                    start = skip_lines(mm, 0, first - 1)
+                    if last is not None:
+                        end = skip_lines(mm, start, last - first + 1)
+                    shown.append(f"lines {first}-{last or 'end'}")
+                elif self.head is not None:
+                    end = skip_lines(mm, 0, self.head)
+                    shown.append(f"first {self.head} lines")
+                else:
+                    start = tail_offset(mm, self.tail)
+                    shown.append(f"last {self.tail} lines")
+        if self.max_bytes is not None and end - start > self.max_bytes:
+            end = start + self.max_bytes
+            shown.append(f"cut at {self.max_bytes} bytes")
+        if (start, end) == (0, size):
+            return start, end, None
+        return (
+            start,
+            end,
+            f"truncated: {', '.join(shown)}; bytes {start}-{end} of {size}",
+        )
+
+
+# Caps the bytes held by read-ahead. Never blocks: a file that does not fit
+# keeps its descriptor open and is streamed when its turn comes.
+class ByteBudget:
+    def __init__(self, limit: int):
+        self.available = limit
+        self.lock = threading.Lock()
+
+    def try_acquire(self, size: int) -> bool:
+        with self.lock:
+            if size > self.available:
+                return False
+            self.available -= size
+            return True
+
+    def release(self, size: int):
+        with self.lock:
+            self.available += size
+
+
+# A file opened and sniffed ahead of its turn. With a budget the rest of the
+# content is read as well if it fits; otherwise emit() copies it from the
+# still-open descriptor. With a window only its span is emitted, and the
+# header carries a truncation marker when that is not the whole file.
+class PendingFile:
+    def __init__(
+        self,
+        filepath: Path,
+        budget: Optional[ByteBudget] = None,
+        window: Optional[ClipWindow] = None,
+    ):
+        self.filepath = filepath
+        self.file = None
+        self.head = b""
+        self.body = None
+        self.span = None
+        self.marker = None
+        self.reserved = 0
+        self.budget = budget
+        self.error = None
+        try:
+            # Unbuffered, so the file offset is exactly the end of the prefix.
+            self.file = open(filepath, "rb", buffering=0)
+            self.head = self.file.read(SNIFF_BYTES)
+            self.is_text = is_text_chunk(self.head)
+            if self.is_text and window is not None:
+                start, end, self.marker = window.span(self.file.fileno())
+                self.span = (start, end)
+                if end <= len(self.head):
+                    self.body = self.head[start:end]
+                    self.close()
+                elif budget is not None and budget.try_acquire(end - start):
+                    self.reserved = end - start
+                    self.body = os.pread(self.file.fileno(), end - start, start)
+                    self.close()
+            elif not self.is_text or len(self.head) < SNIFF_BYTES:
+                self.close()
+            elif budget is not None:
+                rest = os.fstat(self.file.fileno()).st_size - len(self.head)
+                if budget.try_acquire(rest):
+                    self.reserved = rest
+                    self.body = self.file.readall()
+                    self.close()
+        except OSError as e:
+            self.error = e
+            self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def emit(self, out, base_dir: Path = None):
+        try:
+            if self.error is not None:
+                raise self.error
+            if not self.is_text:
+                print(f"# Skipping non-text file: {self.filepath}", file=sys.stderr)
+                return
+
+            filepath = self.filepath
+            rel_path = filepath.relative_to(base_dir) if base_dir else filepath.name
+            if self.span is not None:
+                marker = f"# [{self.marker}]\n" if self.marker else ""
+                out.write(f"###\n# {rel_path}\n{marker}###\n".encode())
+                if self.body is not None:
+                    out.write(self.body)
+                elif self.file is not None:
+                    copy_range(self.file, out, *self.span)
+                out.write(b"\n")
+                return
+            out.write(f"###\n# {rel_path}\n###\n".encode() + self.head)
+            if self.body is not None:
+                out.write(self.body)
+            elif self.file is not None:
+                copy_range(self.file, out, len(self.head))
+            out.write(b"\n")
+        except OSError as e:
+            print(f"# Error reading {self.filepath}: {e}", file=sys.stderr)
+        finally:
+            self.close()
+            self.body = None
+            if self.reserved:
+                self.budget.release(self.reserved)
+                self.reserved = 0
+
+
+# Stands in for a file whose content was already emitted under another path.
+class DuplicateFile:
+    def __init__(self, filepath: Path, same_as: str):
+        self.filepath = filepath
+        self.same_as = same_as
+
+    def emit(self, out, base_dir: Path = None):
+        filepath = self.filepath
+        rel_path = filepath.relative_to(base_dir) if base_dir else filepath.name
+        out.write(f"###\n# {rel_path}\n###\n# Identical to {self.same_as}\n\n".encode())
+
+
+def print_file(
+    filepath: Path,
+    base_dir: Path = None,
+    out=None,
+    window: Optional[ClipWindow] = None,
+):
+    PendingFile(filepath, window=window).emit(out or sys.stdout.buffer, base_dir)
+
+
+# Emits files in the given order while up to READ_AHEAD_PER_WORKER files per
+# worker are opened, sniffed and (budget permitting) read in the background.
+def clip_files(
+    files: list[tuple[Path, Path, Optional[str]]],
+    out,
+    executor: Optional[ThreadPoolExecutor] = None,
+    workers: int = 1,
+    budget_bytes: int = DEFAULT_READ_AHEAD_BYTES,
+    window: Optional[ClipWindow] = None,
+):
+    if executor is None:
+        for filepath, base_dir, same_as in files:
+            if same_as is not None:
+                DuplicateFile(filepath, same_as).emit(out, base_dir)
+            else:
+                print_file(filepath, base_dir, out, window)
+        return
+
+    budget = ByteBudget(budget_bytes)
+    pending = deque()
+    for filepath, base_dir, same_as in files:
+        if same_as is not None:
+            future = executor.submit(DuplicateFile, filepath, same_as)
+        else:
+            future = executor.submit(PendingFile, filepath, budget, window)
+        pending.append((future, base_dir))
+        if len(pending) >= workers * READ_AHEAD_PER_WORKER:
+            future, base = pending.popleft()
+            future.result().emit(out, base)
+    while pending:
+        future, base = pending.popleft()
+        future.result().emit(out, base)
+
+
+def compress_block(block: bytes, method: str, level: int) -> bytes:
+    if method == "gzip":
+        return gzip.compress(block, level, mtime=0)
+    return lzma.compress(block, format=lzma.FORMAT_XZ, preset=level)
 
 
-def should_exclude(filepath: Path, exclude_patterns: list[str]) -> bool:
-    return any(fnmatch.fnmatch(filepath.name, pat) for pat in exclude_patterns)
+# Write-only stream that compresses fixed-size blocks on a thread pool (zlib
+# and lzma release the GIL) and writes them in order. Each block becomes its
+# own gzip member or xz stream; both formats define a concatenation as the
+# concatenated data, so gunzip/xz -d restore the exact bundle.
+class ParallelCompressor:
+    def __init__(self, raw, method: str, level: int, workers: int):
+        self.raw = raw
+        self.method = method
+        self.level = level
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(workers)
+        self.buffer = bytearray()
+        self.pending = deque()
+
+    def write(self, data) -> int:
+        self.buffer += data
+        while len(self.buffer) >= COMPRESS_BLOCK_BYTES:
+            self.submit(bytes(self.buffer[:COMPRESS_BLOCK_BYTES]))
+            del self.buffer[:COMPRESS_BLOCK_BYTES]
+        return len(data)
+
+    def submit(self, block: bytes):
+        self.pending.append(
+            self.executor.submit(compress_block, block, self.method, self.level)
+        )
+        # Bounds memory to a couple of blocks per worker.
+        while len(self.pending) > self.workers * 2:
+            self.raw.write(self.pending.popleft().result())
+
+    def flush(self):
+        # Blocks are only cut at COMPRESS_BLOCK_BYTES; flushing early would
+        # just produce smaller members.
+        pass
+
+    def close(self):
+        try:
+            if self.buffer or not self.pending:
+                self.submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending:
+                self.raw.write(self.pending.popleft().result())
+            self.raw.flush()
+        finally:
+            self.executor.shutdown()
+
+
+def hash_file(filepath: Path) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, "rb") as f:
+        while chunk := f.read(COPY_BUFFER_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Manifest of the last clip: absolute path -> [size, mtime_ns, hash, header
+# path]. A file whose size and mtime match is unchanged without being read;
+# only files whose stat changed are hashed.
+class ClipSnapshot:
+    def __init__(self, manifest_path: Path):
+        self.manifest_path = manifest_path
+        self.files = {}
+        self.entries = {}
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") == SNAPSHOT_VERSION:
+                self.files = manifest["files"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            print(
+                f"# Ignoring unreadable snapshot {manifest_path}: {e}", file=sys.stderr
+            )
+
+    def select(
+        self, files: list[tuple[Path, Path]]
+    ) -> tuple[list[tuple[Path, Path, Optional[str]]], list[str], int]:
+        records = []
+        for filepath, base_dir in files:
+            key = os.path.abspath(filepath)
+            rel_path = str(
+                filepath.relative_to(base_dir) if base_dir else filepath.name
+            )
+            old = self.files.get(key)
+            try:
+                stat = os.stat(filepath)
+                if old and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+                    digest = old[2]
+                else:
+                    digest = hash_file(filepath)
+            except OSError as e:
+                if old and not isinstance(e, FileNotFoundError):
+                    # Still there but unreadable for now: the receiver keeps the
+                    # copy it has, and the file is neither re-sent nor deleted.
+                    print(
+                        f"# Keeping snapshot entry for unreadable {filepath}: {e}",
+                        file=sys.stderr,
+                    )
+                    self.entries[key] = old
+                    continue
+                # Left to the emitter, which reports the error.
+                records.append((filepath, base_dir, None, True))
+                continue
+            changed = old is None or old[2] != digest
+            self.entries[key] = [stat.st_size, stat.st_mtime_ns, digest, rel_path]
+            records.append((filepath, base_dir, digest, changed))
+
+        # Content already in the bundle, unchanged files first, is referenced
+        # instead of emitted again.
+        emitted = {}
+        for filepath, base_dir, digest, changed in records:
+            if not changed:
+                emitted.setdefault(digest, self.entries[os.path.abspath(filepath)][3])
+        selected = []
+        unchanged = 0
+        for filepath, base_dir, digest, changed in records:
+            if not changed:
+                unchanged += 1
+                continue
+            same_as = emitted.get(digest) if digest is not None else None
+            if same_as is None and digest is not None:
+                emitted[digest] = self.entries[os.path.abspath(filepath)][3]
+            selected.append((filepath, base_dir, same_as))
+
+        deleted = sorted(
+            entry[3] for key, entry in self.files.items() if key not in self.entries
+        )
+        return selected, deleted, unchanged
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.manifest_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": SNAPSHOT_VERSION, "files": self.entries}, f)
+            os.replace(tmp_path, self.manifest_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def print_deleted(deleted: list[str], out):
+    out.write(b"###\n# Deleted since snapshot\n###\n")
+    out.write("".join(f"{rel_path}\n" for rel_path in deleted).encode())
+    out.write(b"\n")
 
 
 def main():
@@ -76,31 +662,173 @@ def main():
         "--exclude",
         nargs="*",
         default=[],
-        help="Glob patterns to exclude (e.g. --exclude '*.json' '*.png')",
+        help="Glob patterns to exclude; matching directories are not descended into (e.g. --exclude '*.json' node_modules)",
+    )
+    parser.add_argument(
+        "--gitignore",
+        action="store_true",
+        help="Skip files and directories ignored by .gitignore files in the walked directories",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=1,
+        help="Threads used to list directories and read files ahead in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--read_ahead_bytes",
+        type=int,
+        default=DEFAULT_READ_AHEAD_BYTES,
+        help="Most file content held in memory by -j read-ahead; larger files are streamed in turn",
+    )
+    parser.add_argument(
+        "--since_snapshot",
+        metavar="MANIFEST",
+        help="Emit only files new or changed since the clip recorded in MANIFEST, list deleted ones, then update MANIFEST",
+    )
+    parser.add_argument(
+        "--max_bytes",
+        type=int,
+        help="Emit at most this many bytes of each file (after any line window)",
+    )
+    window_group = parser.add_mutually_exclusive_group()
+    window_group.add_argument(
+        "--head", type=int, metavar="N", help="Emit only the first N lines of each file"
+    )
+    window_group.add_argument(
+        "--tail", type=int, metavar="N", help="Emit only the last N lines of each file"
+    )
+    window_group.add_argument(
+        "--lines",
+        type=parse_line_range,
+        metavar="A:B",
+        help="Emit only lines A through B (1-based, inclusive) of each file",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="Write the bundle to this file instead of stdout",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=["gzip", "xz"],
+        help="Compress the bundle in parallel blocks; gunzip / xz -d restore it exactly",
+    )
+    parser.add_argument(
+        "--compress_level",
+        type=int,
+        choices=range(10),
+        metavar="0-9",
+        help="Compression level (default: 6 for both gzip and xz)",
     )
     args = parser.parse_args()
 
+    if args.compress and args.output is None and sys.stdout.isatty():
+        parser.error("refusing to write compressed output to a terminal; use -o")
+
+    for name in ("head", "tail"):
+        if getattr(args, name) is not None and getattr(args, name) < 1:
+            parser.error(f"--{name} must be at least 1")
+    if args.max_bytes is not None and args.max_bytes < 0:
+        parser.error("--max_bytes must not be negative")
+
+    window = None
+    if any(
+        limit is not None
+        for limit in (args.max_bytes, args.head, args.tail, args.lines)
+    ):
+        window = ClipWindow(args.head, args.tail, args.lines, args.max_bytes)
+
+    matcher = compile_patterns(args.exclude)
+    executor = ThreadPoolExecutor(args.workers) if args.workers > 1 else None
     all_files = []
+    excluded = []
+
+    try:
+        for path_str in args.paths:
+            for resolved_str in glob.glob(path_str):
+                path = Path(resolved_str)
+                if path.is_file():
+                    if matcher is not None and matcher(path.name):
+                        excluded.append(str(path))
+                    else:
+                        all_files.append(path)
+                elif path.is_dir():
+                    found, found_excluded = walk_files(
+                        path, args.level, matcher, args.gitignore, executor
+                    )
+                    all_files.extend(found)
+                    excluded.extend(found_excluded)
 
-    for path_str in args.paths:
-        for resolved_str in glob.glob(path_str):
-            path = Path(resolved_str)
-            if path.is_file():
-                all_files.append(path)
-            elif path.is_dir():
-                found = find_files_in_dir(path, args.level)
-                all_files.extend(found)
-
-    for f in sorted(all_files):
-        if should_exclude(f, args.exclude):
+        for f in sorted(excluded):
             print(f"# Excluded by pattern: {f}", file=sys.stderr)
-            continue
-        base = (
-            f.parents[args.level]
-            if args.level > 0 and len(f.parents) > args.level
-            else f.parent
-        )
-        print_file(f, base_dir=base)
+
+        # The output file may sit inside a walked directory; it is truncated
+        # before the walk results are read, so the bundle must not clip itself.
+        if args.output is not None:
+            output_path = os.path.realpath(args.output)
+            output_name = os.path.basename(output_path)
+            all_files = [
+                f
+                for f in all_files
+                if f.name != output_name or os.path.realpath(f) != output_path
+            ]
+
+        files = []
+        for f in sorted(all_files):
+            base = (
+                f.parents[args.level]
+                if args.level > 0 and len(f.parents) > args.level
+                else f.parent
+            )
+            files.append((f, base))
+
+        raw = sys.stdout.buffer if args.output is None else open(args.output, "wb")
+        out = raw
+        if args.compress:
+            level = 6 if args.compress_level is None else args.compress_level
+            out = ParallelCompressor(raw, args.compress, level, os.cpu_count() or 1)
+        if args.since_snapshot:
+            snapshot = ClipSnapshot(args.since_snapshot)
+            selected, deleted, unchanged = snapshot.select(files)
+            clip_files(
+                selected,
+                out,
+                executor,
+                args.workers,
+                args.read_ahead_bytes,
+                window,
+            )
+            if deleted:
+                print_deleted(deleted, out)
+        else:
+            clip_files(
+                [(f, base, None) for f, base in files],
+                out,
+                executor,
+                args.workers,
+                args.read_ahead_bytes,
+                window,
+            )
+
+        # The bundle is complete before a snapshot records what it contains.
+        if out is not raw:
+            out.close()
+        if args.output is not None:
+            raw.close()
+        else:
+            raw.flush()
+        if args.since_snapshot:
+            snapshot.save()
+            print(
+                f"# Snapshot: {len(selected)} changed, {unchanged} unchanged, {len(deleted)} deleted",
+                file=sys.stderr,
+            )
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import ast_benchmark  # noqa: E402
+import ast_explorer  # noqa: E402
+
+
+def full_counts(source):
+    class_details, function_details, _ = ast_explorer.extract_from_source(source)
+    summary = ast_explorer.FileSummary(
+        "<test>", class_details=class_details, function_details=function_details
+    )
+    return summary.functions, summary.classes
+
+
+def assert_parity(source):
+    # None defers to the full engine, so it can never be wrong; a count can.
+    counts = ast_explorer.count_definitions(source)
+    if counts is not None:
+        assert counts == full_counts(source)
+
+
+@pytest.mark.parametrize(
+    "path", sorted(REPO_ROOT.glob("*.py")), ids=lambda path: path.name
+)
+def test_repo_sources(path):
+    assert_parity(path.read_text())
+
+
+def test_synthetic_corpus(tmp_path):
+    ast_benchmark.generate_tree(
+        tmp_path,
+        files=40,
+        classes=3,
+        methods=4,
+        functions=4,
+        nesting=3,
+        import_density=0.25,
+        files_per_package=10,
+        seed=1,
+    )
+    paths = sorted(tmp_path.rglob("*.py"))
+    assert paths
+    for path in paths:
+        assert_parity(path.read_text())
+
+
+@pytest.mark.parametrize(
+    "source, expected",
+    [
+        ('x = """\ndef fake():\n    class Fake: pass\n"""\ndef real(): pass\n', (1, 0)),
+        ("x = '''\nclass Fake:\n'''\nclass Real: pass\n", (0, 1)),
+        ('def f():\n    """\n    def g():\n    """\n', (1, 0)),
+        ('x = rb"""\ndef fake(): pass\n"""\n', (0, 0)),
+        ('x = f"""{1}\ndef fake(): pass\n"""\n', (0, 0)),
+        ("x = 1 + \\\n    2\ndef f(): pass\n", (1, 0)),
+        ('x = "a \\\ndef fake(): pass"\ndef f(): pass\n', (1, 0)),
+        ("async def f(): pass\nclass C:\n    async def g(): pass\n", (0, 1)),
+        ("define = 1\nclass_ = 2\n# def comment(): pass\n", (0, 0)),
+        ("def f():\n    def g():\n        class C: pass\n", (2, 1)),
+    ],
+)
+def test_targeted_cases(source, expected):
+    assert full_counts(source) == expected
+    assert ast_explorer.count_definitions(source) == expected
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        'x = """\ndef f(): pass\n',
+        "x = '''\nclass C: pass\n",
+    ],
+)
+def test_unterminated_string_defers_to_parser(source):
+    assert ast_explorer.count_definitions(source) is None
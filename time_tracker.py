@@ -1,19 +1,36 @@
 import argparse
+import datetime
+import functools
 import json
 import os
 import select
 import shutil
+import sqlite3
 import sys
+import tempfile
 import termios
 import time
 import tty
-from typing import Optional, TypedDict, cast
+from collections.abc import Iterator, Mapping
+from typing import IO, Callable, Optional, TypedDict, cast
+
+import numpy as np
 
 SECOND_TO_MS = 1e3
 MS_TO_SECOND = 0.001
 
 PRINT_DELAY = 0.3
-SAVE_DELAY = 10.0
+# Journal records replayed on load before they are folded into data.npz.
+JOURNAL_COMPACT_RECORDS = 1000
+SNAPSHOT_VERSION = 1
+# Stop time of an entry that is still being tracked.
+OPEN_STOP = -1
+
+# strftime formats shared by SQLite and Python; weeks start on Monday.
+PERIOD_FORMATS = {"day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}
+REPORT_KINDS = [*PERIOD_FORMATS, "project", "tag"]
+MS_PER_HOUR = 3_600_000
+MS_PER_DAY = 86_400_000
 
 
 class Entry(TypedDict):
@@ -27,44 +44,466 @@ class TimetrackingProject(TypedDict):
     entries: list[Entry]
 
 
-class TimeTracker:
+def day_key(timestamp_ms: int) -> str:
+    return time.strftime(
+        PERIOD_FORMATS["day"], time.localtime(timestamp_ms * MS_TO_SECOND)
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def period_of_day(day: str, kind: str) -> str:
+    if kind == "day":
+        return day
+    date = datetime.datetime.strptime(day, PERIOD_FORMATS["day"])
+    return date.strftime(PERIOD_FORMATS[kind])
+
+
+def write_atomically(path: str, write: Callable[[IO[bytes]], None]) -> None:
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def write_json_atomically(path: str, obj: object) -> None:
+    write_atomically(path, lambda f: f.write(json.dumps(obj).encode()))
+
+
+# Comments as one UTF-8 blob with offsets, as loaded from the snapshot, plus
+# the ones added since. A comment is only decoded when it is read.
+class CommentStore:
+    def __init__(self, blob: bytes = b"", offsets: Optional[np.ndarray] = None):
+        self.blob = blob
+        self.offsets = np.zeros(1, np.int64) if offsets is None else offsets
+        self.added: list[str] = []
+
+    def __getitem__(self, row: int) -> str:
+        packed = len(self.offsets) - 1
+        if row < packed:
+            return self.blob[self.offsets[row] : self.offsets[row + 1]].decode()
+        return self.added[row - packed]
+
+    def append(self, comment: str) -> None:
+        self.added.append(comment)
+
+    def pack(self) -> tuple[bytes, np.ndarray]:
+        if self.added:
+            encoded = [comment.encode() for comment in self.added]
+            lengths = np.fromiter(map(len, encoded), np.int64, len(encoded))
+            self.offsets = np.concatenate(
+                [self.offsets, self.offsets[-1] + np.cumsum(lengths)]
+            )
+            self.blob += b"".join(encoded)
+            self.added = []
+        return self.blob, self.offsets
+
+
+# All entries as parallel columns in start order: int64 start/stop times
+# (OPEN_STOP while tracking), the interned project id and a comment row.
+# Projects and tags are interned to small ints. The arrays grow by doubling;
+# only the first `size` rows are live.
+class EntryColumns:
     def __init__(self) -> None:
-        filename = "data.json"
-        self.local_folderpath: str = os.path.join(
-            os.environ.get("DS_TIME_TRACKING_DIR", "./time_tracker/"), filename
+        self.project_names: list[str] = []
+        self.project_ids: dict[str, int] = {}
+        self.tag_names: list[str] = []
+        self.tag_ids: dict[str, int] = {}
+        self.project_tags: list[list[int]] = []
+        # Newest row per project, -1 before its first entry.
+        self.last_rows: list[int] = []
+        self.size = 0
+        self.starts = np.empty(0, np.int64)
+        self.stops = np.empty(0, np.int64)
+        self.projects = np.empty(0, np.int32)
+        self.comments = CommentStore()
+
+    def add_project(self, project_name: str, tags: list[str]) -> int:
+        project_id = len(self.project_names)
+        self.project_names.append(project_name)
+        self.project_ids[project_name] = project_id
+        self.project_tags.append([self.tag_id(tag) for tag in tags])
+        self.last_rows.append(-1)
+        return project_id
+
+    def tag_id(self, tag: str) -> int:
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = self.tag_ids[tag] = len(self.tag_names)
+            self.tag_names.append(tag)
+        return tag_id
+
+    def tags(self, project_id: int) -> list[str]:
+        return [self.tag_names[tag_id] for tag_id in self.project_tags[project_id]]
+
+    def append(self, project_id: int, start: int, stop: int, comment: str) -> int:
+        if self.size == len(self.starts):
+            capacity = max(16, 2 * self.size)
+            for name in ("starts", "stops", "projects"):
+                column = getattr(self, name)
+                grown = np.empty(capacity, column.dtype)
+                grown[: self.size] = column[: self.size]
+                setattr(self, name, grown)
+        row = self.size
+        self.starts[row] = start
+        self.stops[row] = stop
+        self.projects[row] = project_id
+        self.comments.append(comment)
+        self.last_rows[project_id] = row
+        self.size += 1
+        return row
+
+    # Journal records are replayed onto the snapshot, which may already contain
+    # them if a compaction was interrupted, so they are matched by (project,
+    # start). Rows are in start order, so the search widens back from the
+    # newest row only until it has passed `start`.
+    def find_row(self, project_id: int, start: int) -> Optional[int]:
+        window = 64
+        end = self.size
+        while end > 0:
+            begin = max(self.size - window, 0)
+            hits = np.flatnonzero(
+                (self.starts[begin:end] == start)
+                & (self.projects[begin:end] == project_id)
+            )
+            if len(hits):
+                return begin + int(hits[-1])
+            if self.starts[begin] < start:
+                break
+            end = begin
+            window *= 2
+        return None
+
+    def entries(self, project_id: int) -> list[Entry]:
+        rows = np.flatnonzero(self.projects[: self.size] == project_id)
+        return [
+            {
+                "start": start,
+                "stop": None if stop == OPEN_STOP else stop,
+                "comment": self.comments[row],
+            }
+            for row, start, stop in zip(
+                rows.tolist(), self.starts[rows].tolist(), self.stops[rows].tolist()
+            )
+        ]
+
+    def update_last_rows(self) -> None:
+        last_rows = np.full(len(self.project_names), -1, np.int64)
+        np.maximum.at(last_rows, self.projects[: self.size], np.arange(self.size))
+        self.last_rows = last_rows.tolist()
+
+    @classmethod
+    def from_projects(cls, data: dict[str, TimetrackingProject]) -> "EntryColumns":
+        columns = cls()
+        project_ids = []
+        starts = []
+        stops = []
+        comments = []
+        for project_name, project in data.items():
+            project_id = columns.add_project(project_name, project["tags"])
+            for entry in project["entries"]:
+                project_ids.append(project_id)
+                starts.append(entry["start"])
+                stops.append(OPEN_STOP if entry["stop"] is None else entry["stop"])
+                comments.append(entry["comment"])
+        order = np.argsort(np.array(starts, np.int64), kind="stable")
+        columns.size = len(order)
+        columns.starts = np.array(starts, np.int64)[order]
+        columns.stops = np.array(stops, np.int64)[order]
+        columns.projects = np.array(project_ids, np.int32)[order]
+        columns.comments.added = [comments[row] for row in order.tolist()]
+        columns.comments.pack()
+        columns.update_last_rows()
+        return columns
+
+    def save(self, f: IO[bytes]) -> None:
+        blob, offsets = self.comments.pack()
+        tag_projects = [
+            project_id
+            for project_id, tag_ids in enumerate(self.project_tags)
+            for _ in tag_ids
+        ]
+        np.savez(
+            f,
+            version=np.int64(SNAPSHOT_VERSION),
+            project_names=np.array(self.project_names, dtype=str),
+            tag_names=np.array(self.tag_names, dtype=str),
+            tag_projects=np.array(tag_projects, np.int32),
+            tag_ids=np.array(
+                [tag_id for tag_ids in self.project_tags for tag_id in tag_ids],
+                np.int32,
+            ),
+            starts=self.starts[: self.size],
+            stops=self.stops[: self.size],
+            projects=self.projects[: self.size],
+            comment_blob=np.frombuffer(blob, np.uint8),
+            comment_offsets=offsets,
         )
 
-        if not os.path.exists(self.local_folderpath):
-            print(f"Creating {self.local_folderpath}.")
-            os.makedirs(os.path.dirname(self.local_folderpath), exist_ok=True)
-            with open(self.local_folderpath, "w") as f:
-                json.dump({}, f)
-
-        with open(self.local_folderpath, "r") as f:
-            self.data: dict[str, TimetrackingProject] = cast(
-                dict[str, TimetrackingProject], json.load(f)
+    @classmethod
+    def load(cls, path: str) -> "EntryColumns":
+        columns = cls()
+        with np.load(path) as npz:
+            if int(npz["version"]) != SNAPSHOT_VERSION:
+                raise ValueError(f"{path} has unsupported version {npz['version']}")
+            columns.project_names = npz["project_names"].tolist()
+            columns.project_ids = {
+                project_name: project_id
+                for project_id, project_name in enumerate(columns.project_names)
+            }
+            columns.tag_names = npz["tag_names"].tolist()
+            columns.tag_ids = {
+                tag: tag_id for tag_id, tag in enumerate(columns.tag_names)
+            }
+            columns.project_tags = [[] for _ in columns.project_names]
+            for project_id, tag_id in zip(
+                npz["tag_projects"].tolist(), npz["tag_ids"].tolist()
+            ):
+                columns.project_tags[project_id].append(tag_id)
+            columns.starts = npz["starts"]
+            columns.stops = npz["stops"]
+            columns.projects = npz["projects"]
+            columns.size = len(columns.starts)
+            columns.comments = CommentStore(
+                npz["comment_blob"].tobytes(), npz["comment_offsets"]
             )
+        columns.update_last_rows()
+        return columns
+
+
+# Read-only TimetrackingProject view over the columns; each lookup builds the
+# project's dicts on demand.
+class ProjectsView(Mapping[str, TimetrackingProject]):
+    def __init__(self, columns: EntryColumns) -> None:
+        self.columns = columns
+
+    def __getitem__(self, project_name: str) -> TimetrackingProject:
+        project_id = self.columns.project_ids[project_name]
+        return {
+            "tags": self.columns.tags(project_id),
+            "entries": self.columns.entries(project_id),
+        }
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.columns.project_names)
+
+    def __len__(self) -> int:
+        return len(self.columns.project_names)
 
+
+class TimeTracker:
+    def __init__(self) -> None:
+        directory = os.environ.get("DS_TIME_TRACKING_DIR", "./time_tracker/")
+        self.local_folderpath: str = os.path.join(directory, "data.npz")
+        self.json_path: str = os.path.join(directory, "data.json")
+        self.journal_path: str = os.path.join(directory, "data.journal")
+        self.rollups_path: str = os.path.join(directory, "data.rollups.json")
+
+        if os.path.exists(self.local_folderpath):
+            self.columns = EntryColumns.load(self.local_folderpath)
+        else:
+            os.makedirs(directory, exist_ok=True)
+            if os.path.exists(self.json_path):
+                print(f"Converting {self.json_path} to {self.local_folderpath}.")
+                with open(self.json_path, "r") as f:
+                    self.columns = EntryColumns.from_projects(
+                        cast(dict[str, TimetrackingProject], json.load(f))
+                    )
+            else:
+                print(f"Creating {self.local_folderpath}.")
+                self.columns = EntryColumns()
+            write_atomically(self.local_folderpath, self.columns.save)
+
+        # Closed time in ms per project and per project and start day.
+        self.project_totals: dict[str, int] = {}
+        self.rollups: dict[str, dict[str, int]] = {}
+        if not self.load_rollups():
+            # Rebuilt from the snapshot alone, so they can be stamped with it.
+            self.rebuild_rollups()
+            self.save_rollups()
+        self.journal_records: int = self.replay_journal()
         self.save_on_close = True
+        if self.journal_records >= JOURNAL_COMPACT_RECORDS:
+            self.save_data()
+
+    @property
+    def data(self) -> ProjectsView:
+        return ProjectsView(self.columns)
+
+    def replay_journal(self) -> int:
+        try:
+            with open(self.journal_path, "rb") as f:
+                journal = f.read()
+        except FileNotFoundError:
+            return 0
+
+        records = 0
+        valid_bytes = 0
+        for line in journal.split(b"\n")[:-1]:
+            # Records are only appended whole, so a complete line that does not
+            # decode is corruption in place; the records after it are still good.
+            try:
+                event = json.loads(line)
+                self.apply_event(event)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"Skipping journal record {line.decode(errors='replace')}: {e}")
+            records += 1
+            valid_bytes += len(line) + 1
+        # Only a trailing record without its newline was torn by a crash, and
+        # it was never acknowledged.
+        if valid_bytes < len(journal):
+            print(f"Dropping torn record at the end of {self.journal_path}.")
+            os.truncate(self.journal_path, valid_bytes)
+        return records
+
+    def apply_event(self, event: dict) -> None:
+        columns = self.columns
+        project_name = event["project"]
+        if event["op"] == "register":
+            if project_name not in columns.project_ids:
+                columns.add_project(project_name, event["tags"])
+        elif event["op"] == "start":
+            project_id = columns.project_ids.get(project_name)
+            if project_id is None:
+                project_id = columns.add_project(project_name, [])
+            if columns.find_row(project_id, event["start"]) is None:
+                columns.append(project_id, event["start"], OPEN_STOP, event["comment"])
+        elif event["op"] == "stop":
+            row = columns.find_row(columns.project_ids[project_name], event["start"])
+            if row is not None:
+                start = int(columns.starts[row])
+                # Stopping again replaces the previous duration in the rollups.
+                if columns.stops[row] != OPEN_STOP:
+                    self.add_to_rollups(
+                        project_name, start, start - int(columns.stops[row])
+                    )
+                columns.stops[row] = event["stop"]
+                self.add_to_rollups(project_name, start, event["stop"] - start)
+        else:
+            raise KeyError(event["op"])
+
+    # Applies the event and appends it to the journal as one fsynced line, so
+    # a save costs the same however long the history is.
+    def record_event(self, event: dict) -> None:
+        self.apply_event(event)
+        line = json.dumps(event, separators=(",", ":")) + "\n"
+        with open(self.journal_path, "a") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_records += 1
+
+    def add_to_rollups(self, project_name: str, start: int, duration_ms: int) -> None:
+        days = self.rollups.setdefault(project_name, {})
+        day = day_key(start)
+        days[day] = days.get(day, 0) + duration_ms
+        self.project_totals[project_name] = (
+            self.project_totals.get(project_name, 0) + duration_ms
+        )
+
+    # The rollups file is stamped with the size and mtime of the snapshot it
+    # summarises; any other snapshot means it is stale.
+    def load_rollups(self) -> bool:
+        try:
+            with open(self.rollups_path) as f:
+                rollups = json.load(f)
+            stat = os.stat(self.local_folderpath)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable {self.rollups_path}: {e}")
+            return False
+        if rollups.get("snapshot") != [stat.st_size, stat.st_mtime_ns]:
+            return False
+        self.rollups = rollups["days"]
+        self.project_totals = {
+            project_name: sum(days.values())
+            for project_name, days in self.rollups.items()
+        }
+        return True
+
+    # Bulk rebuild from the columns. Start times are shifted to local time with
+    # one UTC offset per distinct hour (DST changes on the hour), then summed
+    # per (project, day) in a single grouping.
+    def rebuild_rollups(self) -> None:
+        columns = self.columns
+        project_names = columns.project_names
+        stops = columns.stops[: columns.size]
+        closed = stops != OPEN_STOP
+        project_ids = columns.projects[: columns.size][closed].astype(np.int64)
+        starts = columns.starts[: columns.size][closed]
+        stops = stops[closed]
+
+        hours, hour_ids = np.unique(starts // MS_PER_HOUR, return_inverse=True)
+        offsets_ms = np.array(
+            [time.localtime(int(hour) * 3600).tm_gmtoff for hour in hours], np.int64
+        ) * int(SECOND_TO_MS)
+        local_days = (starts + offsets_ms[hour_ids]) // MS_PER_DAY
+        days, day_ids = np.unique(local_days, return_inverse=True)
+        groups, group_ids = np.unique(
+            project_ids * len(days) + day_ids, return_inverse=True
+        )
+        sums = np.bincount(group_ids, weights=stops - starts, minlength=len(groups))
+        group_projects, group_days = np.divmod(groups, max(len(days), 1))
+
+        epoch = datetime.date(1970, 1, 1)
+        day_names = [
+            (epoch + datetime.timedelta(days=day)).isoformat() for day in days.tolist()
+        ]
+        self.rollups = {}
+        for project_id, day_id, total_ms in zip(
+            group_projects.tolist(), group_days.tolist(), sums.astype(np.int64).tolist()
+        ):
+            project_days = self.rollups.setdefault(project_names[project_id], {})
+            project_days[day_names[day_id]] = total_ms
+        project_sums = np.bincount(
+            group_projects, weights=sums, minlength=len(project_names)
+        ).astype(np.int64)
+        self.project_totals = {
+            project_name: total_ms
+            for project_name, total_ms in zip(project_names, project_sums.tolist())
+            if project_name in self.rollups
+        }
+
+    def save_rollups(self) -> None:
+        stat = os.stat(self.local_folderpath)
+        write_json_atomically(
+            self.rollups_path,
+            {"snapshot": [stat.st_size, stat.st_mtime_ns], "days": self.rollups},
+        )
 
+    # Compaction: rewrites data.npz atomically with everything replayed so
+    # far, stamps the rollups with it, then empties the journal.
     def save_data(self) -> None:
-        with open(self.local_folderpath, "w") as f:
-            json.dump(self.data, f, indent=4)
+        write_atomically(self.local_folderpath, self.columns.save)
+        self.save_rollups()
+        with open(self.journal_path, "w") as f:
+            os.fsync(f.fileno())
+        self.journal_records = 0
 
     def register_new_project(
         self,
         project_name: str,
         tags: Optional[list[str]] = None,
     ) -> None:
-        if project_name in self.data:
+        if project_name in self.columns.project_ids:
             print(f"Project {project_name} already exists")
             return
 
-        self.data[project_name] = {
-            "tags": tags or [],
-            "entries": [],
-        }
-        self.save_data()
+        self.record_event(
+            {"op": "register", "project": project_name, "tags": tags or []}
+        )
         print(f"Registered new project: {project_name} with tags: {tags or []}")
 
     def start_tracking(
@@ -72,74 +511,385 @@ class TimeTracker:
         project_name: str,
         comment: Optional[str] = None,
     ) -> None:
-        if project_name not in self.data:
+        if project_name not in self.columns.project_ids:
             print(f"Registering {project_name=} before tracking.")
             self.register_new_project(project_name)
 
-        self.data[project_name]["entries"].append(
+        self.record_event(
             {
+                "op": "start",
+                "project": project_name,
                 "start": int(time.time() * SECOND_TO_MS),
-                "stop": None,
                 "comment": comment or "",
             }
         )
 
     def stop_tracking(self, project_name: str) -> None:
-        if project_name not in self.data:
+        project_id = self.columns.project_ids.get(project_name)
+        if project_id is None:
             print(f"Project {project_name} not found")
             return
+        row = self.columns.last_rows[project_id]
+        if row < 0:
+            print(f"Project {project_name} has no entries")
+            return
 
-        self.data[project_name]["entries"][-1]["stop"] = int(time.time() * SECOND_TO_MS)
-        self.save_data()
+        self.record_event(
+            {
+                "op": "stop",
+                "project": project_name,
+                "start": int(self.columns.starts[row]),
+                "stop": int(time.time() * SECOND_TO_MS),
+            }
+        )
 
     def get_total_time_in_project(self, project_name: str) -> float:
-        total_time_ms = 0
-        for entry in self.data[project_name]["entries"]:
-            if entry["stop"] is not None:
-                total_time_ms += entry["stop"] - entry["start"]
-        return total_time_ms * MS_TO_SECOND
+        return self.project_totals.get(project_name, 0) * MS_TO_SECOND
+
+    # Same result as SQLiteTimeTracker.report, read from the per-day rollups;
+    # the range is whole local days.
+    def report(
+        self,
+        kind: str,
+        since_ms: Optional[int] = None,
+        until_ms: Optional[int] = None,
+    ) -> list[tuple[str, float]]:
+        since_day = day_key(since_ms) if since_ms is not None else None
+        until_day = day_key(until_ms - 1) if until_ms is not None else None
+        totals: dict[str, int] = {}
+        for project_name, days in self.rollups.items():
+            for day, total_ms in days.items():
+                if (since_day is not None and day < since_day) or (
+                    until_day is not None and day > until_day
+                ):
+                    continue
+                if kind in PERIOD_FORMATS:
+                    keys = [period_of_day(day, kind)]
+                elif kind == "project":
+                    keys = [project_name]
+                else:
+                    keys = self.columns.tags(self.columns.project_ids[project_name])
+                for key in keys:
+                    totals[key] = totals.get(key, 0) + total_ms
+
+        if kind in PERIOD_FORMATS:
+            ordered = sorted(totals.items())
+        else:
+            ordered = sorted(totals.items(), key=lambda item: -item[1])
+        return [(key, total_ms * MS_TO_SECOND) for key, total_ms in ordered]
 
     def list_projects(self) -> None:
-        for project_name, project_data in self.data.items():
+        for project_id, project_name in enumerate(self.columns.project_names):
             total_time: float = self.get_total_time_in_project(project_name)
-            tags: list[str] = project_data["tags"]
-            formatted_time: str = format_pretty_time(total_time)
-            if tags:
-                formatted_tags: str = f"\n\tTags:\n\t\t{tags}"
-            else:
-                formatted_tags: str = ""
-            print(
-                f"{project_name}\n\tTime Passed:\n\t\t{formatted_time}{formatted_tags}"
-            )
-            print()
+            print_project(project_name, total_time, self.columns.tags(project_id))
 
     def __del__(self) -> None:
-        if self.save_on_close:
+        if self.save_on_close and self.journal_records >= JOURNAL_COMPACT_RECORDS:
             print("Starting to save the data.")
             self.save_data()
             print("Data saved.")
 
     def clear_data(self) -> None:
         response = (
-            input("Are you sure you want to delete data.json? (y/n/b for backup): ")
+            input("Are you sure you want to delete data.npz? (y/n/b for backup): ")
             .strip()
             .lower()
         )
         if response == "y":
-            os.remove(self.local_folderpath)
-            print("data.json has been deleted.")
+            self.remove_storage()
+            print("data.npz has been deleted.")
             self.save_on_close = False
         elif response == "b":
+            # Folds the journal in first so the backup holds the full history.
+            self.save_data()
             backup_path = self.local_folderpath + ".backup"
             shutil.copy2(self.local_folderpath, backup_path)
+            self.remove_storage()
+            self.save_on_close = False
+            print(
+                f"Backup created and data.npz has been deleted. Backup path: {backup_path}"
+            )
+        else:
+            print("Operation cancelled.")
+
+    # Includes a converted data.json, which would otherwise be imported again.
+    def remove_storage(self) -> None:
+        for path in (
+            self.local_folderpath,
+            self.journal_path,
+            self.rollups_path,
+            self.json_path,
+        ):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+TRACKER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS project_tags (
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (project_id, tag)
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    project_id INTEGER NOT NULL REFERENCES projects(id) ON DELETE CASCADE,
+    start INTEGER NOT NULL,
+    stop INTEGER,
+    comment TEXT NOT NULL,
+    UNIQUE (project_id, start)
+);
+CREATE INDEX IF NOT EXISTS project_tags_tag ON project_tags(tag);
+CREATE INDEX IF NOT EXISTS entries_start ON entries(start);
+CREATE INDEX IF NOT EXISTS entries_stop ON entries(stop);
+"""
+
+
+# Same interface as TimeTracker, backed by data.sqlite3. Every call commits its
+# own transaction, and reports are aggregated by SQLite over the indexes.
+class SQLiteTimeTracker:
+    def __init__(self) -> None:
+        self.local_folderpath: str = os.path.join(
+            os.environ.get("DS_TIME_TRACKING_DIR", "./time_tracker/"), "data.sqlite3"
+        )
+        if not os.path.exists(self.local_folderpath):
+            print(f"Creating {self.local_folderpath}.")
+            os.makedirs(os.path.dirname(self.local_folderpath), exist_ok=True)
+        self.connection = sqlite3.connect(self.local_folderpath)
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(TRACKER_SCHEMA)
+
+    def project_id(self, project_name: str) -> Optional[int]:
+        row = self.connection.execute(
+            "SELECT id FROM projects WHERE name = ?", (project_name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def register_new_project(
+        self,
+        project_name: str,
+        tags: Optional[list[str]] = None,
+    ) -> None:
+        if self.project_id(project_name) is not None:
+            print(f"Project {project_name} already exists")
+            return
+
+        with self.connection:
+            project_id = self.connection.execute(
+                "INSERT INTO projects (name) VALUES (?)", (project_name,)
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO project_tags (project_id, tag) VALUES (?, ?)",
+                [(project_id, tag) for tag in tags or []],
+            )
+        print(f"Registered new project: {project_name} with tags: {tags or []}")
+
+    def start_tracking(
+        self,
+        project_name: str,
+        comment: Optional[str] = None,
+    ) -> None:
+        if self.project_id(project_name) is None:
+            print(f"Registering {project_name=} before tracking.")
+            self.register_new_project(project_name)
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO entries (project_id, start, stop, comment)"
+                " VALUES (?, ?, NULL, ?)",
+                (
+                    self.project_id(project_name),
+                    int(time.time() * SECOND_TO_MS),
+                    comment or "",
+                ),
+            )
+
+    def stop_tracking(self, project_name: str) -> None:
+        project_id = self.project_id(project_name)
+        if project_id is None:
+            print(f"Project {project_name} not found")
+            return
+
+        with self.connection:
+            self.connection.execute(
+                "UPDATE entries SET stop = ? WHERE id = ("
+                " SELECT id FROM entries WHERE project_id = ?"
+                " ORDER BY start DESC LIMIT 1)",
+                (int(time.time() * SECOND_TO_MS), project_id),
+            )
+
+    def get_total_time_in_project(self, project_name: str) -> float:
+        (total_time_ms,) = self.connection.execute(
+            "SELECT TOTAL(stop - start) FROM entries JOIN projects"
+            " ON projects.id = entries.project_id"
+            " WHERE projects.name = ? AND stop IS NOT NULL",
+            (project_name,),
+        ).fetchone()
+        return total_time_ms * MS_TO_SECOND
+
+    def project_tags(self) -> dict[int, list[str]]:
+        tags: dict[int, list[str]] = {}
+        for project_id, tag in self.connection.execute(
+            "SELECT project_id, tag FROM project_tags ORDER BY rowid"
+        ):
+            tags.setdefault(project_id, []).append(tag)
+        return tags
+
+    def list_projects(self) -> None:
+        tags = self.project_tags()
+        rows = self.connection.execute(
+            "SELECT projects.id, projects.name, TOTAL(entries.stop - entries.start)"
+            " FROM projects LEFT JOIN entries ON entries.project_id = projects.id"
+            " AND entries.stop IS NOT NULL"
+            " GROUP BY projects.id ORDER BY projects.id"
+        )
+        for project_id, project_name, total_time_ms in rows.fetchall():
+            print_project(
+                project_name, total_time_ms * MS_TO_SECOND, tags.get(project_id, [])
+            )
+
+    # Closed entries starting in [since_ms, until_ms), totalled per period,
+    # project or tag. Entries are attributed to the period they started in.
+    def report(
+        self,
+        kind: str,
+        since_ms: Optional[int] = None,
+        until_ms: Optional[int] = None,
+    ) -> list[tuple[str, float]]:
+        where = "entries.stop IS NOT NULL"
+        params: list = []
+        if since_ms is not None:
+            where += " AND entries.start >= ?"
+            params.append(since_ms)
+        if until_ms is not None:
+            where += " AND entries.start < ?"
+            params.append(until_ms)
+
+        if kind in PERIOD_FORMATS:
+            query = (
+                "SELECT strftime(?, entries.start / 1000, 'unixepoch', 'localtime')"
+                " AS key, TOTAL(entries.stop - entries.start) FROM entries"
+                f" WHERE {where} GROUP BY key ORDER BY key"
+            )
+            params.insert(0, PERIOD_FORMATS[kind])
+        elif kind == "project":
+            query = (
+                "SELECT projects.name, TOTAL(entries.stop - entries.start) AS total"
+                " FROM entries JOIN projects ON projects.id = entries.project_id"
+                f" WHERE {where} GROUP BY projects.id ORDER BY total DESC"
+            )
+        else:
+            query = (
+                "SELECT project_tags.tag, TOTAL(entries.stop - entries.start) AS total"
+                " FROM entries JOIN project_tags"
+                " ON project_tags.project_id = entries.project_id"
+                f" WHERE {where} GROUP BY project_tags.tag ORDER BY total DESC"
+            )
+        return [
+            (key, total_time_ms * MS_TO_SECOND)
+            for key, total_time_ms in self.connection.execute(query, params)
+        ]
+
+    # Imports projects and entries; entries already present (same project and
+    # start) are skipped, so importing again is harmless.
+    def import_data(self, data: Mapping[str, TimetrackingProject]) -> int:
+        before = self.connection.total_changes
+        with self.connection:
+            for project_name, project in data.items():
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO projects (name) VALUES (?)",
+                    (project_name,),
+                )
+                project_id = self.project_id(project_name)
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO project_tags (project_id, tag)"
+                    " VALUES (?, ?)",
+                    [(project_id, tag) for tag in project["tags"]],
+                )
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO entries (project_id, start, stop, comment)"
+                    " VALUES (?, ?, ?, ?)",
+                    [
+                        (project_id, entry["start"], entry["stop"], entry["comment"])
+                        for entry in project["entries"]
+                    ],
+                )
+        return self.connection.total_changes - before
+
+    def save_data(self) -> None:
+        # Every change is committed as it happens.
+        pass
+
+    def clear_data(self) -> None:
+        response = (
+            input("Are you sure you want to delete data.sqlite3? (y/n/b for backup): ")
+            .strip()
+            .lower()
+        )
+        if response == "y":
+            self.connection.close()
+            os.remove(self.local_folderpath)
+            print("data.sqlite3 has been deleted.")
+        elif response == "b":
+            backup_path = self.local_folderpath + ".backup"
+            with sqlite3.connect(backup_path) as backup:
+                self.connection.backup(backup)
+            backup.close()
+            self.connection.close()
             os.remove(self.local_folderpath)
             print(
-                f"Backup created and data.json has been deleted. Backup path: {backup_path}"
+                f"Backup created and data.sqlite3 has been deleted. Backup path: {backup_path}"
             )
         else:
             print("Operation cancelled.")
 
 
+def migrate_json_to_sqlite() -> None:
+    json_tracker = TimeTracker()
+    json_tracker.save_on_close = False
+    sqlite_tracker = SQLiteTimeTracker()
+    changes = sqlite_tracker.import_data(json_tracker.data)
+    entries = sum(len(project["entries"]) for project in json_tracker.data.values())
+    print(
+        f"Migrated {len(json_tracker.data)} projects with {entries} entries from"
+        f" {json_tracker.local_folderpath} to {sqlite_tracker.local_folderpath}"
+        f" ({changes} rows written)."
+    )
+
+
+def print_project(project_name: str, total_time: float, tags: list[str]) -> None:
+    formatted_time: str = format_pretty_time(total_time)
+    if tags:
+        formatted_tags: str = f"\n\tTags:\n\t\t{tags}"
+    else:
+        formatted_tags: str = ""
+    print(f"{project_name}\n\tTime Passed:\n\t\t{formatted_time}{formatted_tags}")
+    print()
+
+
+def parse_date(value: str) -> datetime.datetime:
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD, got {value!r}")
+
+
+def date_range_ms(
+    since: Optional[datetime.datetime], until: Optional[datetime.datetime]
+) -> tuple[Optional[int], Optional[int]]:
+    # Local midnights; `until` is inclusive, so the range ends a day after it.
+    since_ms = int(since.timestamp() * SECOND_TO_MS) if since else None
+    if until is not None:
+        until += datetime.timedelta(days=1)
+    until_ms = int(until.timestamp() * SECOND_TO_MS) if until else None
+    return since_ms, until_ms
+
+
 def is_data() -> bool:
     return select.select([sys.stdin], [], [], 0) == ([sys.stdin], [], [])
 
@@ -179,12 +929,48 @@ def main() -> None:
     parser.add_argument(
         "--clear",
         action="store_true",
-        help="Clear the data.json file with confirmation",
+        help="Clear the tracking data (data.npz) with confirmation",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["json", "sqlite"],
+        default=os.environ.get("DS_TIME_TRACKING_BACKEND", "json"),
+        help="Storage backend: json keeps a data.npz snapshot plus a data.journal of changes since it (and data.rollups.json totals), converting a legacy data.json on first use; sqlite keeps data.sqlite3 (default: $DS_TIME_TRACKING_BACKEND or json)",
+    )
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="Copy the json backend's entries (data.npz with data.journal replayed) into data.sqlite3 for the sqlite backend",
+    )
+    parser.add_argument(
+        "--report",
+        choices=REPORT_KINDS,
+        help="Total tracked time per day, week, month, project or tag",
+    )
+    parser.add_argument(
+        "--since",
+        type=parse_date,
+        help="Only report entries started on or after this date (YYYY-MM-DD)",
+    )
+    parser.add_argument(
+        "--until",
+        type=parse_date,
+        help="Only report entries started on or before this date (YYYY-MM-DD)",
     )
 
     args = parser.parse_args()
 
-    time_tracker = TimeTracker()
+    if args.migrate:
+        migrate_json_to_sqlite()
+        return
+
+    time_tracker = TimeTracker() if args.backend == "json" else SQLiteTimeTracker()
+
+    if args.report:
+        since_ms, until_ms = date_range_ms(args.since, args.until)
+        for key, total_time in time_tracker.report(args.report, since_ms, until_ms):
+            print(f"{key}\t{format_pretty_time(total_time)}")
+        return
 
     if args.list:
         time_tracker.list_projects()
@@ -206,7 +992,6 @@ def main() -> None:
     print(f"Started tracking project: {project_name}")
 
     t0: float = time.time()
-    time_until_next_save: float = t0 + SAVE_DELAY
     old_settings = termios.tcgetattr(sys.stdin)
     tty.setcbreak(sys.stdin.fileno())
     try:
@@ -216,9 +1001,6 @@ def main() -> None:
             print(f"\r{formatted_time} elapsed.", end="")
             sys.stdout.flush()
             time.sleep(PRINT_DELAY)
-            if time.time() > time_until_next_save:
-                time_tracker.save_data()
-                time_until_next_save = time.time() + SAVE_DELAY
     finally:
         termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
 